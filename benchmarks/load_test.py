@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+
+SERVE_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serve.py')
+
+# The seconds a rerun may take before the session counts it as failed
+RERUN_TIMEOUT = 60
+
+# The seconds the server has to warm up its dataset and start listening
+SERVER_START_TIMEOUT = 600
+
+
+class Session:
+    """A browser session of the app, over the websocket of the server.
+
+    The widgets are found by their labels in the elements of the last rerun.
+    The values set on the widgets are sent with every rerun, as the browser
+    does, and a click is sent with the next rerun only.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.widgets = []
+        self.widget_states = {}
+        self.triggers = {}
+
+    def widget(self, label):
+        # The first widget of the last rerun whose label contains label, or None
+        return next((widget for widget in self.widgets if label in widget.label), None)
+
+    def set_value(self, label, **value):
+        # Set a widget to a value given by its type, e.g. double_value=2
+        widget = self.widget(label)
+        (value_type, value), = value.items()
+        widget_state = WidgetState(id=widget.id)
+        if value_type == 'string_array_value':
+            widget_state.string_array_value.data.extend(value)
+        else:
+            setattr(widget_state, value_type, value)
+        self.widget_states[widget.id] = widget_state
+
+    def click(self, label):
+        widget = self.widget(label)
+        self.triggers[widget.id] = WidgetState(id=widget.id, trigger_value=True)
+
+    async def rerun(self):
+        """Rerun the script with the values of the widgets, and wait for it to finish."""
+        message = BackMsg()
+        message.rerun_script.query_string = ''
+        message.rerun_script.widget_states.widgets.extend(list(self.widget_states.values()) + list(self.triggers.values()))
+        self.triggers = {}
+        await self.websocket.send(message.SerializeToString())
+
+        self.widgets = []
+        while True:
+            forward_msg = ForwardMsg()
+            forward_msg.ParseFromString(await asyncio.wait_for(self.websocket.recv(), RERUN_TIMEOUT))
+            message_type = forward_msg.WhichOneof('type')
+
+            if message_type == 'delta' and forward_msg.delta.WhichOneof('type') == 'new_element':
+                element = forward_msg.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'exception':
+                    raise RuntimeError(element.exception.message)
+                element = getattr(element, element_type)
+                if 'id' in element.DESCRIPTOR.fields_by_name and 'label' in element.DESCRIPTOR.fields_by_name:
+                    self.widgets.append(element)
+
+            elif message_type == 'script_finished':
+                if forward_msg.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError('The script did not compile')
+                return
+
+
+def pick_preferences(session):
+    session.set_value("What do you care about", string_array_value=["Natural Light", "Large Windows", "High Ceiling"])
+    session.set_value("Bedrooms", double_value=2)
+    session.set_value("Postcode", string_value="NW")
+
+
+def reorder_preferences(session):
+    session.set_value("What do you care about", string_array_value=["High Ceiling", "Natural Light", "Large Windows"])
+
+
+def broaden_preferences(session):
+    session.set_value("What do you care about", string_array_value=["No Carpets", "Natural Light"])
+    session.set_value("Min Rent", double_value=100)
+    session.set_value("Max Rent", double_value=10000)
+    for label in ("Hide properties with insufficient photos", "Hide properties with limited bedroom photos", "Hide rental rooms"):
+        session.set_value(label, bool_value=False)
+
+
+def search(session):
+    session.click("Search")
+
+
+def next_page(session):
+    button = session.widget("Next")
+    if button is not None and not button.disabled:
+        session.click("Next")
+
+
+# The journeys of the sessions through the app, as the steps made before each rerun after the
+# landing page. The broad journey pages through a search of thousands of results, which used
+# to be the path where searches over 1500 results were rejected
+JOURNEYS = {
+    'landing': [],
+    'search': [pick_preferences, search],
+    'reorder': [pick_preferences, search, reorder_preferences, search],
+    'broad': [broaden_preferences, search, next_page, next_page],
+}
+JOURNEY_WEIGHTS = {'landing': 2, 'search': 4, 'reorder': 3, 'broad': 1}
+
+
+class LoadResults:
+
+    def __init__(self):
+        self.latencies = {}
+        self.sessions = 0
+        self.errors = []
+
+    def observe(self, step, seconds):
+        self.latencies.setdefault(step, []).append(seconds)
+
+    def finish_session(self, error=None):
+        self.sessions += 1
+        if error is not None:
+            self.errors.append(error)
+
+
+def percentile(values, fraction):
+    # The value below which the fraction of the values are, by the nearest rank
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def latency_summary(values):
+    return {
+        'reruns': len(values),
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': max(values),
+    }
+
+
+def server_rss(pid):
+    # The resident memory of the server process, None when it is not a process of this host
+    try:
+        with open(f'/proc/{pid}/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, TypeError):
+        return None
+
+
+async def run_session(url, journey, results, think_time, rng):
+    # One session through a journey on its own websocket, timing the rerun of every step
+    steps = [('landing', None)] + [(step.__name__, step) for step in JOURNEYS[journey]]
+
+    try:
+        async with websockets.connect(url, subprotocols=['streamlit'], max_size=None) as websocket:
+            session = Session(websocket)
+            for name, step in steps:
+                if step is not None:
+                    await asyncio.sleep(think_time * rng.random() * 2)
+                    step(session)
+                start_time = time.perf_counter()
+                await session.rerun()
+                results.observe(name, time.perf_counter() - start_time)
+    except Exception as error:
+        results.finish_session(f'{journey}: {error!r}')
+        return
+
+    results.finish_session()
+
+
+async def run_load(url, server_pid, number_of_sessions, concurrency, duration, think_time, rng):
+    """Run the sessions against the server with concurrency of them at a time, and return the report of their reruns.
+
+    With a duration, sessions keep being started until it has passed, for a soak test.
+    """
+    journeys = list(JOURNEY_WEIGHTS)
+    weights = [JOURNEY_WEIGHTS[journey] for journey in journeys]
+
+    results = LoadResults()
+    baseline_rss = peak_rss = server_rss(server_pid)
+    start_time = time.perf_counter()
+    started = 0
+
+    async def run_sessions():
+        # One simulated user, starting a new session when the last one ends
+        nonlocal started
+        while started < number_of_sessions or (duration and time.perf_counter() - start_time < duration):
+            started += 1
+            await run_session(url, rng.choices(journeys, weights)[0], results, think_time, rng)
+
+    async def sample_memory():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss or 0, server_rss(server_pid) or 0) or None
+            await asyncio.sleep(0.2)
+
+    sampler = asyncio.create_task(sample_memory())
+    await asyncio.gather(*(run_sessions() for _ in range(concurrency)))
+    sampler.cancel()
+
+    elapsed = time.perf_counter() - start_time
+    all_latencies = [seconds for latencies in results.latencies.values() for seconds in latencies]
+    return {
+        'sessions': results.sessions,
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'reruns_per_second': len(all_latencies) / elapsed if elapsed else 0,
+        'sessions_per_second': results.sessions / elapsed if elapsed else 0,
+        'latency': latency_summary(all_latencies) if all_latencies else None,
+        'latency_by_step': {step: latency_summary(latencies) for step, latencies in sorted(results.latencies.items())},
+        'baseline_rss_bytes': baseline_rss,
+        'peak_rss_bytes': peak_rss,
+        # The memory the server holds for each of the sessions running at the same time, on top of the shared dataset
+        'rss_bytes_per_session': max(0, peak_rss - baseline_rss) / concurrency if baseline_rss else None,
+        'errors': results.errors[:20],
+        'number_of_errors': len(results.errors),
+    }
+
+
+def start_server(port):
+    # The app served by serve.py with its warm-up, as it is deployed, ready once its health check answers
+    server = subprocess.Popen(
+        [sys.executable, SERVE_SCRIPT, '--', '--server.headless', 'true', '--server.port', str(port)],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'The server exited with {server.returncode}')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise TimeoutError('The server did not start')
+
+
+# Drive simulated browser sessions over the websocket of one app server, all of them sharing
+# its process as real users do, and report the throughput, the rerun latency and the memory of
+# the server per session at each level of concurrency. Rising levels show where latency degrades
+#
+#   python -m benchmarks.load_test --sessions 200 --concurrency 1 5 10 20 50
+#   python -m benchmarks.load_test --concurrency 50 --duration 1800 --think-time 2 --output soak.json
+#
+# A server is started with serve.py from the current directory, unless --url points to a running one.
+# A synthetic dataset can be made with
+#
+#   python -m benchmarks.synthetic 100000 data/properties.csv
+#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the app server with simulated sessions.')
+    parser.add_argument('--sessions', type=int, default=100, help='The number of sessions to run at each level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10], help='The sessions running at the same time, one level after the other')
+    parser.add_argument('--duration', type=float, help='Keep starting sessions for this many seconds at each level')
+    parser.add_argument('--think-time', type=float, default=0, help='The mean seconds a session waits between steps')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='The websocket of a running server, e.g. ws://127.0.0.1:8501/_stcore/stream')
+    parser.add_argument('--port', type=int, default=8599, help='The port of the server started for the test')
+    parser.add_argument('--output', help='Write the report to this json file')
+    args = parser.parse_args()
+
+    server = None if args.url else start_server(args.port)
+    url = args.url or f'ws://127.0.0.1:{args.port}/_stcore/stream'
+    rng = random.Random(args.seed)
+    try:
+        levels = [
+            asyncio.run(run_load(url, server and server.pid, args.sessions, concurrency, args.duration, args.think_time, rng))
+            for concurrency in args.concurrency
+        ]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {'python': sys.version.split()[0], 'url': url, 'levels': levels}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    sys.exit(1 if any(level['number_of_errors'] for level in levels) else 0)
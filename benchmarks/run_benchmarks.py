@@ -0,0 +1,197 @@
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.synthetic import generate_properties
+from columnar import read_columns, write_columns
+from dataset import SMILEY_FACE_COLUMNS, Dataset, add_derived_columns, apply_face, apply_faces, file_signature, read_properties_csv
+from features import features_dict
+from materialized_rankings import MaterializedRanking
+from ranking import preference_weights, preferences_alignment, rank_alignment
+from search_engine import SearchPreferences, SearchResults, find_properties
+from similar_homes import SimilarityIndex
+
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+# The preference combinations searched, from the defaults of the search form to broad and narrow searches
+FEATURE_ORDERINGS = [
+    (),
+    ("Natural Light",),
+    ("Natural Light", "Large Windows", "High Ceiling"),
+    ("No Carpets", "No Wide Lenses", "No Edited Photos", "Natural Light", "Large Windows", "High Ceiling"),
+]
+SEARCHES = {
+    'default': SearchPreferences(),
+    'broad': SearchPreferences(min_monthly_rent=100, max_monthly_rent=10_000, exclude_enough_photos_overall=False,
+                               exclude_enough_bedroom_photos=False, exclude_room_to_rent=False),
+    'postcode': SearchPreferences(postcode='NW'),
+    'narrow': SearchPreferences(number_of_bedrooms=2, postcode='SW1', min_monthly_rent=1200, max_monthly_rent=1800,
+                                exclude_zoopla=True),
+}
+
+# The columns of the results table before the score dots
+TABLE_COLUMNS = ("title", "address", "monthly_int", "platform", "link", "agent_name")
+
+# The filters timed on their own, on top of the rent range and the number of bedrooms
+FILTER_STAGES = {
+    'rent_bedrooms': {},
+    'postcode': {'postcode': 'NW1'},
+    'photos_overall': {'exclude_enough_photos_overall': True},
+    'bedroom_photos': {'exclude_enough_bedroom_photos': True},
+    'room_to_rent': {'exclude_room_to_rent': True},
+    'platform': {'exclude_zoopla': True},
+}
+
+
+def median_time(function, repeat):
+    # The median of the seconds taken by function over repeat runs
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start_time)
+    return statistics.median(timings)
+
+
+def filter_positions(dataset, preferences):
+    return dataset.index.filter_positions(
+        preferences.min_monthly_rent,
+        preferences.max_monthly_rent,
+        preferences.postcode,
+        preferences.number_of_bedrooms,
+        exclude_enough_photos_overall=preferences.exclude_enough_photos_overall,
+        exclude_enough_bedroom_photos=preferences.exclude_enough_bedroom_photos,
+        exclude_room_to_rent=preferences.exclude_room_to_rent,
+        excluded_platforms=preferences.excluded_platforms(),
+    )
+
+
+def check_face_parity(df):
+    # The vectorized score dots must be the same as the ones of apply_face, value by value
+    for score_column in SMILEY_FACE_COLUMNS:
+        scores = df[score_column].to_numpy(dtype=np.float64)
+        expected = [apply_face(score) for score in scores]
+        if list(apply_faces(scores)) != expected:
+            raise AssertionError(f'The score dots of {score_column} differ from apply_face')
+
+
+def benchmark_size(number_of_properties, repeat, work_path):
+    # The timings of every stage of the search pipeline for one dataset size
+    timings = {}
+
+    csv_path = os.path.join(work_path, f'properties_{number_of_properties}.csv')
+    generate_properties(number_of_properties).to_csv(csv_path, index=False)
+
+    timings['load.csv'] = median_time(lambda: read_properties_csv(csv_path), repeat)
+    df = read_properties_csv(csv_path)
+
+    columnar_path = os.path.join(work_path, f'properties_{number_of_properties}')
+    write_columns(df, columnar_path)
+    timings['load.columnar'] = median_time(lambda: read_columns(columnar_path), repeat)
+
+    scores = df[list(SMILEY_FACE_COLUMNS)].to_numpy(dtype=np.float64)
+    timings['derive.score_dots'] = median_time(lambda: apply_faces(scores), repeat)
+    timings['derive.all'] = median_time(lambda: add_derived_columns(df.copy()), repeat)
+    check_face_parity(df)
+
+    df = add_derived_columns(df)
+    timings['index.build'] = median_time(lambda: Dataset(csv_path, file_signature(csv_path), df), repeat)
+    dataset = Dataset(csv_path, file_signature(csv_path), df)
+
+    # The similar homes of a property in the middle of the rent range, over all of them and within £200
+    timings['similar.index'] = median_time(
+        lambda: SimilarityIndex(dataset.column('property_id'), dataset.feature_scores, dataset.index.monthly_rent), repeat
+    )
+    similar_homes = dataset.similar_homes
+    position = similar_homes.position(dataset.column('property_id').iloc[len(dataset) // 2])
+    timings['similar.all'] = median_time(lambda: similar_homes.nearest(position, 10), repeat)
+    timings['similar.rent_band'] = median_time(lambda: similar_homes.nearest(position, 10, rent_band=200), repeat)
+
+    for stage, options in FILTER_STAGES.items():
+        preferences = SearchPreferences(exclude_enough_photos_overall=False, exclude_enough_bedroom_photos=False,
+                                        exclude_room_to_rent=False)._replace(**options)
+        timings[f'filter.{stage}'] = median_time(lambda: filter_positions(dataset, preferences.normalized()), repeat)
+
+    for (search_name, preferences), ordering in itertools.product(SEARCHES.items(), FEATURE_ORDERINGS):
+        if not ordering:
+            continue
+        positions = filter_positions(dataset, preferences.normalized())
+        if not len(positions):
+            continue
+        weights = preference_weights(ordering)
+        name = f'{search_name}.{len(ordering)}_features'
+
+        timings[f'score.{name}'] = median_time(lambda: preferences_alignment(dataset.feature_scores, positions, weights), repeat)
+        alignment = preferences_alignment(dataset.feature_scores, positions, weights)
+        timings[f'sort.{name}'] = median_time(lambda: rank_alignment(alignment), repeat)
+        timings[f'sort_top_50.{name}'] = median_time(lambda: rank_alignment(alignment, 50), repeat)
+
+        # The ranking made ahead of time for the ordering, and the properties picked out of it
+        timings[f'materialize.{len(ordering)}_features'] = median_time(lambda: MaterializedRanking(dataset.feature_scores, ordering), repeat)
+        ranking = MaterializedRanking(dataset.feature_scores, ordering)
+        timings[f'rank_materialized.{name}'] = median_time(lambda: ranking.rank(positions), repeat)
+
+        # The whole search without the result cache, and the first page of the results table
+        search_preferences = preferences._replace(order_feature_options=ordering).normalized()
+        timings[f'search.{name}'] = median_time(lambda: find_properties(dataset, search_preferences), repeat)
+        search_results = SearchResults(dataset, *find_properties(dataset, search_preferences))
+        page_columns = TABLE_COLUMNS + tuple(features_dict[feature][2] for feature in ordering)
+        timings[f'page.{name}'] = median_time(lambda: search_results.rows(0, 50, page_columns), repeat)
+
+    return timings
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    # The stages slower than the baseline by more than the tolerance
+    regressions = []
+    for size, timings in results['sizes'].items():
+        for stage, seconds in timings.items():
+            baseline_seconds = baseline.get('sizes', {}).get(size, {}).get(stage)
+            if baseline_seconds is None:
+                continue
+            if seconds > baseline_seconds * (1 + tolerance) and seconds - baseline_seconds > min_seconds:
+                regressions.append(f'{size} rows {stage}: {baseline_seconds * 1000:.2f}ms -> {seconds * 1000:.2f}ms')
+    return regressions
+
+
+# Time the search pipeline on synthetic datasets, and compare the timings with a baseline
+#
+#   python -m benchmarks.run_benchmarks --output bench_output.json
+#   python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+#   python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the property search pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='The numbers of properties to generate')
+    parser.add_argument('--repeat', type=int, default=5, help='The runs of each stage, the median is reported')
+    parser.add_argument('--output', help='Write the timings to this json file')
+    parser.add_argument('--baseline', help='Compare the timings with this json file and fail on regressions')
+    parser.add_argument('--save-baseline', help='Write the timings as the new baseline to this json file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='The slowdown allowed over the baseline')
+    parser.add_argument('--min-seconds', type=float, default=0.001, help='Slowdowns shorter than this are ignored')
+    args = parser.parse_args()
+
+    results = {'python': sys.version.split()[0], 'numpy': np.__version__, 'sizes': {}}
+    with tempfile.TemporaryDirectory() as work_path:
+        for number_of_properties in args.sizes:
+            results['sizes'][str(number_of_properties)] = benchmark_size(number_of_properties, args.repeat, work_path)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as output_file:
+                output_file.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance, args.min_seconds)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,77 @@
+import argparse
+import numpy as np
+import pandas as pd
+from features import FEATURE_SCORE_COLUMNS
+
+
+# Realistic values for the generated properties
+PLATFORMS = ["Rightmove", "Zoopla"]
+OUTWARD_CODES = [
+    f"{area}{district}"
+    for area in ("E", "EC", "N", "NW", "SE", "SW", "W", "WC", "BR", "CR", "HA", "IG", "KT", "TW", "UB")
+    for district in range(1, 21)
+]
+STREETS = ["High Street", "Station Road", "Church Lane", "Park Avenue", "Victoria Road", "Green Lane", "Mill Road", "Kings Road"]
+TITLES = ["{} bedroom flat to rent", "{} bedroom apartment to rent", "{} bedroom house to rent", "Room to rent", "Studio to rent"]
+AGENCIES = [f"Agency {i}" for i in range(400)]
+
+# The score values where the score dots change, and values outside the expected range
+EDGE_SCORES = [0.0, 0.2, 0.4, 0.6, 0.8, 1.0, -0.1, 1.1, np.nan]
+
+
+def generate_properties(number_of_properties, seed=0):
+    """Return a frame of random properties with the columns of data/properties.csv."""
+    rng = np.random.default_rng(seed)
+
+    bedrooms = rng.choice([1, 2, 3], size=number_of_properties, p=[0.5, 0.35, 0.15])
+    outward_codes = rng.choice(OUTWARD_CODES, size=number_of_properties)
+    inward_codes = [
+        f"{digit}{letters}"
+        for digit, letters in zip(
+            rng.integers(0, 10, size=number_of_properties),
+            rng.choice([f"{a}{b}" for a in "ABDEFGHJLNPQRSTUWXYZ" for b in "ABDEFGHJLNPQRSTUWXYZ"], size=number_of_properties),
+        )
+    ]
+    streets = rng.choice(STREETS, size=number_of_properties)
+    titles = rng.choice(TITLES, size=number_of_properties, p=[0.4, 0.3, 0.15, 0.1, 0.05])
+
+    df = pd.DataFrame({
+        'property_id': [f"{100000000 + i}" for i in range(number_of_properties)],
+        'title': [title.format(bedroom) for title, bedroom in zip(titles, bedrooms)],
+        'address': [
+            f"{number} {street}, London {outward} {inward}"
+            for number, street, outward, inward in zip(
+                rng.integers(1, 300, size=number_of_properties), streets, outward_codes, inward_codes
+            )
+        ],
+        'monthly_int': (rng.lognormal(mean=7.2, sigma=0.35, size=number_of_properties) // 25 * 25).astype(int),
+        'bed_number': bedrooms,
+        'platform': rng.choice(PLATFORMS, size=number_of_properties),
+        'link': [f"https://example.com/properties/{100000000 + i}" for i in range(number_of_properties)],
+        'agent_name': rng.choice(AGENCIES, size=number_of_properties),
+        'number_of_photos_overall_score': rng.choice([0, 1], size=number_of_properties, p=[0.2, 0.8]),
+        'number_of_bedroom_photos_score': rng.choice([0, 1], size=number_of_properties, p=[0.3, 0.7]),
+    })
+
+    # The feature scores, with some of them on the edges of the score dots
+    for column in FEATURE_SCORE_COLUMNS:
+        scores = rng.random(number_of_properties).round(3)
+        edges = rng.random(number_of_properties) < 0.05
+        scores[edges] = rng.choice(EDGE_SCORES, size=edges.sum())
+        df[column] = scores
+
+    return df
+
+
+# Write a synthetic properties csv
+#
+#   python -m benchmarks.synthetic 100000 data/properties.csv
+#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic properties csv file.')
+    parser.add_argument('number_of_properties', type=int)
+    parser.add_argument('output')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_properties(args.number_of_properties, args.seed).to_csv(args.output, index=False)
@@ -0,0 +1,22 @@
+import argparse
+import time
+from columnar import write_columns
+from dataset import COLUMNAR_DATA_PATH, DATA_PATH, add_derived_columns, read_properties_csv
+
+
+# Convert the properties csv into the columnar dataset loaded by the app
+#
+#   python build_dataset.py [--csv data/properties.csv] [--output data/properties]
+#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the columnar properties dataset from the csv file.')
+    parser.add_argument('--csv', default=DATA_PATH, help='The properties csv file')
+    parser.add_argument('--output', default=COLUMNAR_DATA_PATH, help='The directory of the columnar dataset')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    # The derived columns are stored too, so that every process maps them instead of deriving its own
+    df = add_derived_columns(read_properties_csv(args.csv))
+    write_columns(df, args.output)
+
+    print(f'Wrote {len(df)} properties to {args.output} in {time.perf_counter() - start_time:.2f}s')
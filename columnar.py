@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# The file describing the columns of a columnar dataset, written last by write_columns
+MANIFEST_FILE = 'manifest.json'
+
+# The columns that hold whole numbers, stored as integers when they have no missing values
+INTEGER_COLUMNS = ('monthly_int', 'bed_number')
+
+# Text columns with more distinct values than this ratio of the rows are stored as their
+# utf-8 bytes and offsets, mapped like the other columns, rather than as categories
+MAX_CATEGORY_RATIO = 0.5
+
+
+def _is_text(series):
+    return not pd.api.types.is_bool_dtype(series) and not pd.api.types.is_numeric_dtype(series)
+
+
+def _column_values(series):
+    # The stored form of a column, and the categories of a string column
+    if pd.api.types.is_bool_dtype(series):
+        return series.to_numpy(), None
+
+    if pd.api.types.is_numeric_dtype(series):
+        if series.name in INTEGER_COLUMNS and series.notna().all() and (series % 1 == 0).all():
+            return pd.to_numeric(series, downcast='integer').to_numpy(), None
+        return series.to_numpy(dtype=np.float32), None
+
+    # Everything else is text, stored as category codes
+    categorical = pd.Categorical(series)
+    codes = pd.to_numeric(pd.Series(categorical.codes), downcast='integer').to_numpy()
+    return codes, [str(category) for category in categorical.categories]
+
+
+def _string_buffers(series):
+    # The utf-8 bytes of the strings one after the other, the offset of each string in them,
+    # and which strings are missing
+    values = series.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    encoded = [b'' if is_missing else str(value).encode() for value, is_missing in zip(values, missing)]
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8), missing
+
+
+def _read_strings(path, column):
+    # A text column stored as bytes and offsets. With pyarrow the column is a view of the mapped
+    # files, shared by all the processes mapping them; without it the strings are decoded
+    offsets = np.load(os.path.join(path, column['offsets']), mmap_mode='r', allow_pickle=False)
+    data = np.load(os.path.join(path, column['file']), mmap_mode='r', allow_pickle=False)
+    missing = np.load(os.path.join(path, column['missing']), allow_pickle=False) if 'missing' in column else None
+
+    if pa is not None:
+        validity = None if missing is None else pa.py_buffer(np.packbits(~missing, bitorder='little'))
+        strings = pa.LargeStringArray.from_buffers(len(offsets) - 1, pa.py_buffer(offsets), pa.py_buffer(data), validity)
+        return pd.arrays.ArrowExtensionArray(strings)
+
+    blob = data.tobytes()
+    values = np.array([blob[start:stop].decode() for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())], dtype=object)
+    if missing is not None:
+        values[missing] = None
+    return values
+
+
+def write_columns(df, path):
+    """Write df to the directory path as one .npy file per column.
+
+    path is a link to a directory of the dataset, built next to it and swapped in
+    at the end with one rename, so readers never see it missing and running
+    processes keep reading the files they have already mapped.
+    """
+    build_path = f'{path}.{time.time_ns()}-{os.getpid()}'
+    os.makedirs(build_path)
+
+    manifest = {'rows': len(df), 'columns': []}
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        file_name = f'{i:03d}.npy'
+        column = {'name': name, 'file': file_name}
+
+        if _is_text(series) and series.nunique() > len(series) * MAX_CATEGORY_RATIO:
+            offsets, data, missing = _string_buffers(series)
+            np.save(os.path.join(build_path, file_name), data, allow_pickle=False)
+            column['offsets'] = f'{i:03d}.offsets.npy'
+            np.save(os.path.join(build_path, column['offsets']), offsets, allow_pickle=False)
+            if missing.any():
+                column['missing'] = f'{i:03d}.missing.npy'
+                np.save(os.path.join(build_path, column['missing']), missing, allow_pickle=False)
+            column['dtype'] = 'str'
+        else:
+            values, categories = _column_values(series)
+            np.save(os.path.join(build_path, file_name), np.ascontiguousarray(values), allow_pickle=False)
+            column['dtype'] = str(values.dtype)
+            if categories is not None:
+                column['categories'] = categories
+
+        manifest['columns'].append(column)
+
+    with open(os.path.join(build_path, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    # Swap the link to the new dataset in one rename. A dataset written before the datasets were
+    # linked is moved aside first, and kept as the previous one
+    previous_path = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        previous_path = f'{path}.{time.time_ns()}-{os.getpid()}.old'
+        os.rename(path, previous_path)
+    link_path = f'{build_path}.link'
+    os.symlink(os.path.basename(build_path), link_path)
+    os.replace(link_path, path)
+
+    # The datasets before the previous one are removed, the previous one may still be being read.
+    # Only the directories named by this function are removed, whatever else is next to them
+    directory, base = os.path.split(os.path.abspath(path))
+    version_name = re.compile(rf'{re.escape(base)}\.[0-9]+-[0-9]+(\.old)?')
+    kept_paths = (os.path.realpath(build_path), previous_path and os.path.realpath(previous_path))
+    for name in os.listdir(directory):
+        old_path = os.path.join(directory, name)
+        if version_name.fullmatch(name) and os.path.realpath(old_path) not in kept_paths:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+def read_columns(path):
+    """Return the frame stored in the directory path, with its columns memory-mapped."""
+    # The files are read from the dataset the link points to now, even if it is swapped meanwhile
+    path = os.path.realpath(path)
+    with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    columns = {}
+    for column in manifest['columns']:
+        if 'offsets' in column:
+            columns[column['name']] = _read_strings(path, column)
+            continue
+
+        values = np.load(os.path.join(path, column['file']), mmap_mode='r', allow_pickle=False)
+        if 'categories' in column:
+            values = pd.Categorical.from_codes(values, categories=column['categories'])
+        columns[column['name']] = values
+
+    # The columns are not consolidated, so the numeric ones stay backed by the mapped files
+    return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,431 @@
+import hashlib
+import logging
+import os
+import threading
+from functools import cached_property
+import numpy as np
+import pandas as pd
+from columnar import MANIFEST_FILE, MAX_CATEGORY_RATIO, read_columns
+from features import FEATURE_SCORE_COLUMNS
+from materialized_rankings import MaterializedRanking
+from metrics import metrics
+from postcodes import extract_postcodes
+from search_index import SearchIndex, merge_rows
+from shared_arrays import shared_array
+from similar_homes import SimilarityIndex
+
+
+# The location of the properties data file, and of the columnar dataset built from it
+DATA_PATH = os.path.join('data', 'properties.csv')
+COLUMNAR_DATA_PATH = os.path.join('data', 'properties')
+
+# The directory of the listing deltas applied on top of the data file. Each delta is a csv
+# file with the columns of the data file, where a true 'removed' column removes the row
+# with that property_id and any other row replaces or adds it. Deltas are applied in the
+# order of their file names, and should be cleared when a new data file is dropped
+DELTAS_PATH = os.path.join('data', 'deltas')
+
+# The score columns and the columns with the score dots built from them
+SMILEY_FACE_COLUMNS = {
+    'natural_light_score': 'natural_light_smiley_face',
+    'large_windows_score': 'large_windows_smiley_face',
+    'high_ceiling_score': 'high_ceiling_smiley_face',
+    'fireplace_score': 'fireplace_smiley_face',
+    'no_carpet_score': 'no_carpet_smiley_face',
+    'wide_lenses_score': 'wide_lenses_smiley_face',
+    'overprocessed_score': 'overprocessed_smiley_face',
+}
+
+
+# The columns added to the data file when it is loaded, stored with it by build_dataset.py
+DERIVED_COLUMNS = tuple(SMILEY_FACE_COLUMNS.values()) + ('outward_code', 'postcode_sector')
+
+
+def apply_face(value):
+    if value <= 0:
+        #return '⚪⚪⚪⚪⚪'
+        return '○○○○○'
+    elif 0 < value < 0.2:
+        #return '🟠⚪⚪⚪⚪'
+        return '●○○○○'
+    elif 0.2 <= value < 0.4:
+        #return '🟠🟠⚪⚪⚪'
+        return '●●○○○'
+    elif 0.4 <= value < 0.6:
+        #return '🟠🟠🟠⚪⚪'
+        return '●●●○○'
+    elif 0.6 <= value < 0.8:
+        #return '🟠🟠🟠🟠⚪'
+        return '●●●●○'
+    elif 0.8 <= value <= 1:
+        #return '🟠🟠🟠🟠🟠'
+        return '●●●●●'
+    else:
+        return 'None'  # In case the value is outside the expected range
+
+
+# The score dots by bucket, as returned by apply_face. The last one is for values
+# outside the expected range, including missing scores
+FACES = np.array(['○○○○○', '●○○○○', '●●○○○', '●●●○○', '●●●●○', '●●●●●', 'None'], dtype=object)
+FACE_BIN_EDGES = [0, 0.2, 0.4, 0.6, 0.8]
+
+
+def face_buckets(values):
+    # The index in FACES of each value, with the same boundaries as apply_face
+    values = np.asarray(values, dtype=np.float64)
+    buckets = np.digitize(values, FACE_BIN_EDGES)
+    buckets[values <= 0] = 0
+    buckets[(values > 1) | np.isnan(values)] = len(FACES) - 1
+    return buckets
+
+
+def apply_faces(values):
+    # Vectorized apply_face over an array of any shape
+    return FACES[face_buckets(values)]
+
+
+class Dataset:
+    """The prepared properties frame for one version of the data file.
+
+    The frame is shared by every session in the process and must be treated as
+    read-only. Filtering creates new frames, so nothing should write to it.
+    The rows added by deltas are kept apart in delta_rows, so that the frame of
+    the data file stays as it was read, memory-mapped for a columnar dataset.
+    """
+
+    def __init__(self, path, signature, df, applied_deltas=(), delta_rows=None, index=None, feature_scores=None, deltas_digest='0'):
+        self.path = path
+        self.signature = signature
+        self.applied_deltas = tuple(applied_deltas)
+        # The version is shared with the other processes by the shared arrays and the result cache,
+        # so it names the deltas applied by their digest rather than by their number
+        self.deltas_digest = deltas_digest
+        self.version = '{}-{}.{}'.format(*signature, deltas_digest)
+        self.df = df
+        self.delta_rows = delta_rows
+        with metrics.time_stage('index'):
+            self.index = index if index is not None else SearchIndex(df)
+            self.feature_scores = shared_array(os.path.abspath(path), self.version, 'feature_scores', feature_scores or (lambda: feature_score_matrix(df)))
+        self.memory_bytes = frame_memory(df) + self.feature_scores.nbytes + (delta_rows.nbytes if delta_rows is not None else 0)
+
+        # The rankings of the most searched orderings of the features, None until they are first made
+        self.rankings = None
+
+    def __len__(self):
+        return self.index.size
+
+    def rows(self, positions):
+        # The frame of the rows at positions, in that order
+        if self.delta_rows is None:
+            return self.df.iloc[positions]
+
+        positions = np.asarray(positions, dtype=np.int64)
+        from_delta = self.delta_rows.from_delta[positions]
+        row_numbers = self.delta_rows.row_numbers[positions]
+        rows = pd.concat([self.df.iloc[row_numbers[~from_delta]], self.delta_rows.df.iloc[row_numbers[from_delta]]])
+
+        # Back in the order of positions, labelled by position
+        order = np.concatenate([np.flatnonzero(~from_delta), np.flatnonzero(from_delta)])
+        rows.index = positions[order]
+        return rows.iloc[np.argsort(order, kind='stable')]
+
+    def column(self, name):
+        # The values of one column at every position
+        if self.delta_rows is None:
+            return self.df[name]
+        return pd.Series(self.delta_rows.gather(self.df[name].to_numpy(dtype=object), self.delta_rows.df[name].to_numpy(dtype=object)))
+
+    def materialize_rankings(self, orderings):
+        """Rank all the properties for each of the orderings, reusing the rankings already made.
+
+        The rankings of the other orderings are dropped. The new rankings replace
+        the old ones at once, so searches running meanwhile use either of them.
+        """
+        old_rankings = self.rankings or {}
+        with metrics.time_stage('materialize_rankings'):
+            rankings = {
+                ordering: old_rankings.get(ordering) or MaterializedRanking(self.feature_scores, ordering)
+                for ordering in orderings
+            }
+
+        self.memory_bytes += sum(ranking.nbytes for ranking in rankings.values()) - sum(ranking.nbytes for ranking in old_rankings.values())
+        self.rankings = rankings
+
+    @cached_property
+    def similar_homes(self):
+        # The index of the properties in feature score space, only built for the first similar homes search
+        with metrics.time_stage('similar_homes_index'):
+            return SimilarityIndex(self.column('property_id'), self.feature_scores, self.index.monthly_rent)
+
+    def apply_deltas(self, names, upserted, removed_ids=(), deltas_digest=None):
+        """Return the next version of the dataset, with the rows of the deltas replaced.
+
+        The rows of upserted, if any, replace the rows with the same property_id
+        or are added, and the rows of removed_ids are dropped. Only the new rows are
+        derived and indexed, the indexes of this version are patched into the
+        ones of the next. This version is left untouched for the sessions still
+        using it, and shares the frame of the data file with the next one.
+        deltas_digest identifies the deltas applied so far, by default from the
+        names of the deltas in order.
+        """
+        # Deltas that only remove rows add an empty frame of the columns of the data file
+        if upserted is None:
+            upserted = self.df.iloc[:0]
+        delta_df = add_derived_columns(upserted.copy()).sort_values(by='monthly_int', kind='stable', ignore_index=True)
+
+        changed_ids = set(removed_ids) | set(upserted['property_id'])
+        delta_rows = self.delta_rows or DeltaRows(delta_df.iloc[:0], np.zeros(len(self), dtype=bool), np.arange(len(self)))
+        kept = ~delta_rows.gather(self.df['property_id'].isin(changed_ids).to_numpy(),
+                                  delta_rows.df['property_id'].isin(changed_ids).to_numpy())
+
+        # The kept rows are still in rent order, and the new rows go after the kept rows of the same rent
+        kept_positions = np.flatnonzero(kept)
+        insertions = np.searchsorted(self.index.monthly_rent[kept_positions], delta_df['monthly_int'].to_numpy(), side='right')
+        new_positions = insertions + np.arange(len(delta_df))
+        old_to_new = np.full(len(self), -1, dtype=np.int64)
+        old_to_new[kept_positions] = np.arange(len(kept_positions)) + np.searchsorted(insertions, np.arange(len(kept_positions)), side='right')
+
+        with metrics.time_stage('apply_deltas'):
+            index = self.index.patched(old_to_new, new_positions, delta_df)
+            delta_rows = delta_rows.patched(delta_df, old_to_new, new_positions)
+
+        return Dataset(
+            self.path, self.signature, self.df, self.applied_deltas + tuple(names), delta_rows, index,
+            lambda: merge_rows(self.feature_scores, feature_score_matrix(delta_df), old_to_new, new_positions),
+            deltas_digest or chain_digest(self.deltas_digest, [name.encode() for name in names]),
+        )
+
+
+class DeltaRows:
+    """The rows added by deltas on top of the frame of a data file.
+
+    The rows of the deltas still in the dataset are kept in a frame of their own,
+    and each position of the dataset points to its row in either frame.
+    """
+
+    def __init__(self, df, from_delta, row_numbers):
+        self.df = df
+        # Whether the row at each position is in the frame of the deltas, and its number in its frame
+        self.from_delta = from_delta
+        self.row_numbers = row_numbers
+        self.nbytes = frame_memory(df) + from_delta.nbytes + row_numbers.nbytes
+
+    def gather(self, values, delta_values):
+        # The value of the row at each position, from the values of the rows of either frame
+        gathered = np.empty(len(self.from_delta), dtype=np.result_type(values, delta_values))
+        gathered[~self.from_delta] = values[self.row_numbers[~self.from_delta]]
+        gathered[self.from_delta] = delta_values[self.row_numbers[self.from_delta]]
+        return gathered
+
+    def patched(self, delta_df, old_to_new, new_positions):
+        # The rows of the next version, with the rows of the deltas still used renumbered and those of delta_df after them
+        kept = old_to_new >= 0
+        live_rows = np.sort(self.row_numbers[kept & self.from_delta])
+        row_numbers = self.row_numbers.copy()
+        row_numbers[self.from_delta] = np.searchsorted(live_rows, row_numbers[self.from_delta])
+
+        df = compact_columns(pd.concat([self.df.iloc[live_rows], delta_df], ignore_index=True))
+        return DeltaRows(
+            df,
+            merge_rows(self.from_delta, np.ones(len(delta_df), dtype=bool), old_to_new, new_positions),
+            merge_rows(row_numbers, np.arange(len(live_rows), len(df)), old_to_new, new_positions),
+        )
+
+
+def feature_score_matrix(df):
+    # The feature scores of every row as one contiguous matrix, with NULL scores as 0
+    return np.ascontiguousarray(df[FEATURE_SCORE_COLUMNS].fillna(0).to_numpy(dtype=np.float32))
+
+
+def default_data_path():
+    # The columnar dataset when it has been built from the latest csv file, the csv file otherwise,
+    # so that a new data drop is loaded before the columnar dataset is built again
+    manifest_path = os.path.join(COLUMNAR_DATA_PATH, MANIFEST_FILE)
+    try:
+        manifest_time = os.stat(manifest_path).st_mtime_ns
+    except FileNotFoundError:
+        return DATA_PATH
+    try:
+        if os.stat(DATA_PATH).st_mtime_ns > manifest_time:
+            return DATA_PATH
+    except FileNotFoundError:
+        pass
+    return COLUMNAR_DATA_PATH
+
+
+def file_signature(path):
+    # The modification time and size identify a data drop without reading it. A columnar
+    # dataset is identified by its manifest, which is the last file written
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_FILE)
+    stat_result = os.stat(path)
+    return (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def read_properties_csv(path):
+    # Load the csv with the data
+    return pd.read_csv(path, dtype={'property_id': 'str'}).sort_values(by='monthly_int', ascending=True)
+
+
+def read_properties(path):
+    # Map the columnar dataset, which is already sorted, or load the csv
+    with metrics.time_stage('load'):
+        if os.path.isdir(path):
+            df = read_columns(path)
+        else:
+            df = read_properties_csv(path)
+
+    with metrics.time_stage('derive'):
+        return add_derived_columns(df)
+
+
+def add_derived_columns(df):
+    # A columnar dataset built with its derived columns maps them like the others
+    if all(column in df for column in DERIVED_COLUMNS):
+        return compact_columns(df)
+
+    # Add new columns with the score dots, binning all the score columns at once. Each row
+    # only keeps the bucket of its dots, the dots themselves are the shared categories
+    buckets = face_buckets(df[list(SMILEY_FACE_COLUMNS)].to_numpy(dtype=np.float64)).astype(np.int8)
+    for i, face_column in enumerate(SMILEY_FACE_COLUMNS.values()):
+        df[face_column] = pd.Categorical.from_codes(buckets[:, i], categories=FACES)
+
+    # Add the outward code and the sector of the postcode, used by the postcode filter
+    df['outward_code'], df['postcode_sector'] = extract_postcodes(df['address'])
+
+    return compact_columns(df)
+
+
+def compact_columns(df):
+    # Keep the scores as float32, and the text that repeats across rows as categories
+    for column in df.columns:
+        if df[column].dtype == np.float64 and column.endswith('_score'):
+            df[column] = df[column].astype(np.float32)
+        elif (df[column].dtype == object or isinstance(df[column].dtype, pd.StringDtype)) and df[column].nunique() <= len(df) * MAX_CATEGORY_RATIO:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def frame_memory(df):
+    # The bytes held by the frame, including the strings
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# The prepared datasets of this process, one per path given to load_dataset, None for the
+# default data file, whichever of the csv file and the columnar dataset that is
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+# The keys of _datasets whose next dataset is being prepared in the background
+_preparing = set()
+
+logger = logging.getLogger('property_search.dataset')
+
+# Export the memory held by the datasets with the other metrics
+metrics.add_collector(lambda: {'dataset_bytes': sum(dataset.memory_bytes for dataset in list(_datasets.values()))})
+
+
+def chain_digest(digest, parts):
+    # The digest of the parts in order, following digest
+    chain = hashlib.sha1(digest.encode())
+    for part in parts:
+        chain.update(hashlib.sha1(part).digest())
+    return chain.hexdigest()[:16]
+
+
+def read_deltas_digest(digest, deltas_path, names):
+    # The digest of the names and the contents of the delta files in order, following digest,
+    # so that a delta file replaced or dropped out of order makes another version
+    parts = []
+    for name in names:
+        with open(os.path.join(deltas_path, name), 'rb') as delta_file:
+            parts.extend([name.encode(), delta_file.read()])
+    return chain_digest(digest, parts)
+
+
+def read_deltas(deltas_path, names):
+    # The rows replaced or added by the delta files, and the ids of the rows they remove, the later files winning
+    frames = [pd.read_csv(os.path.join(deltas_path, name), dtype={'property_id': 'str'}) for name in names]
+    last = ~pd.concat([frame['property_id'] for frame in frames], ignore_index=True).duplicated(keep='last').to_numpy()
+
+    upserted, removed_ids = [], []
+    for frame in frames:
+        frame_last, last = last[:len(frame)], last[len(frame):]
+        removed = frame.pop('removed').fillna(False).astype(bool).to_numpy() if 'removed' in frame else np.zeros(len(frame), dtype=bool)
+        # The files that only remove rows have no other columns to add
+        if (frame_last & ~removed).any():
+            upserted.append(frame[frame_last & ~removed])
+        removed_ids.extend(frame.loc[frame_last & removed, 'property_id'])
+
+    return (pd.concat(upserted, ignore_index=True) if upserted else None), removed_ids
+
+
+def pending_deltas(dataset, deltas_path=DELTAS_PATH):
+    # The names of the delta files not yet applied to the dataset, in order
+    if deltas_path is None or not os.path.isdir(deltas_path):
+        return []
+    return sorted(
+        name for name in os.listdir(deltas_path)
+        if name.endswith('.csv') and name not in dataset.applied_deltas
+    )
+
+
+def next_dataset(dataset, path, deltas_path):
+    # The dataset of the current data file with all the pending deltas applied in one pass,
+    # reusing dataset when the data file did not change, and ranking the orderings it ranked
+    signature = file_signature(path)
+    previous = dataset
+    if dataset is None or dataset.path != path or dataset.signature != signature:
+        dataset = Dataset(path, signature, read_properties(path))
+
+    names = pending_deltas(dataset, deltas_path)
+    if names:
+        deltas_digest = read_deltas_digest(dataset.deltas_digest, deltas_path, names)
+        dataset = dataset.apply_deltas(names, *read_deltas(deltas_path, names), deltas_digest=deltas_digest)
+
+    if previous is not None and previous.rankings:
+        dataset.materialize_rankings(list(previous.rankings))
+    return dataset
+
+
+def prepare_in_background(key, deltas_path):
+    # Only one thread prepares the next dataset of a key, the sessions keep using the loaded one meanwhile
+    with _datasets_lock:
+        if key in _preparing:
+            return
+        _preparing.add(key)
+    threading.Thread(target=_prepare, args=(key, deltas_path), name=f'prepare-{key or "dataset"}', daemon=True).start()
+
+
+def _prepare(key, deltas_path):
+    try:
+        # The next dataset replaces the loaded one, even when it was read from another data file
+        _datasets[key] = next_dataset(_datasets[key], key or default_data_path(), deltas_path)
+    except Exception:
+        logger.exception('Could not prepare the next dataset of %s', key or 'the data file')
+    finally:
+        with _datasets_lock:
+            _preparing.discard(key)
+
+
+def load_dataset(path=None, deltas_path=DELTAS_PATH):
+    """Return the prepared dataset for path, or for the default data file, loading it on the first call.
+
+    Afterwards a new data drop, the default data file moving between the csv
+    file and the columnar dataset, or deltas dropped in deltas_path unless it
+    is None, are prepared in the background. The loaded dataset is returned
+    until the next one is ready and replaces it.
+    """
+    dataset = _datasets.get(path)
+    if dataset is None:
+        # Only one session loads the data file, the others wait and reuse it
+        with _datasets_lock:
+            dataset = _datasets.get(path)
+            if dataset is None:
+                dataset = _datasets[path] = next_dataset(None, path or default_data_path(), deltas_path)
+        return dataset
+
+    data_path = path or default_data_path()
+    if dataset.path != data_path or dataset.signature != file_signature(data_path) or pending_deltas(dataset, deltas_path):
+        prepare_in_background(path, deltas_path)
+    return dataset
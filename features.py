@@ -0,0 +1,13 @@
+# Configure the dictionary for features ordering
+features_dict = {
+    "Natural Light": ["natural_light_score", False, "natural_light_smiley_face"],
+    "Large Windows": ["large_windows_score", False, "large_windows_smiley_face"],
+    "High Ceiling": ["high_ceiling_score", False, "high_ceiling_smiley_face"],
+    "Fireplace": ["fireplace_score", False, "fireplace_smiley_face"],
+    "No Carpets": ["no_carpet_score", False, "no_carpet_smiley_face"],
+    "No Wide Lenses": ["wide_lenses_score", True, "wide_lenses_smiley_face"],
+    "No Edited Photos": ["overprocessed_score", True, "overprocessed_smiley_face"],
+}
+
+# The score columns of the features, in the order of the columns of the feature score matrix
+FEATURE_SCORE_COLUMNS = [feature[0] for feature in features_dict.values()]
@@ -1,7 +1,18 @@
 import os
+import time
+import uuid
 import streamlit as st
-import pandas as pd
 from datetime import datetime
+from features import features_dict
+from metrics import metrics, start_exporters, start_profile, stop_profile
+
+
+# Time the whole rerun, and profile it when asked with ?profile=1 and PROFILE_DIR is set
+rerun_start_time = time.perf_counter()
+rerun_profile = start_profile() if st.query_params.get("profile") == "1" else None
+
+# Export the metrics of this process as configured in the environment
+start_exporters()
 
 
 # Start with the page config
@@ -17,6 +28,13 @@ st.set_page_config(
 
 
 
+# Count the reruns of each session
+first_session_rerun = "session_id" not in st.session_state
+if first_session_rerun:
+    st.session_state.session_id = uuid.uuid4().hex
+metrics.count_rerun(st.session_state.session_id)
+
+
 # Configure the sidebar
 with st.sidebar:
     st.page_link('main.py', label='Home', icon=':material/house:', disabled=True)
@@ -35,64 +53,139 @@ def main_button_click():
         st.session_state.searches_count += 1
 
 
+def change_results_page(step):
+    st.session_state.results_page += step
+    st.session_state.results_page_changed = True
+
+
 def show_no_results_error():
     st.error(":material/sentiment_dissatisfied: Sorry, no results were found. Please try again with different preferences.")
 
 
 
-def apply_face(value):
-    if value <= 0:
-        #return '⚪⚪⚪⚪⚪'
-        return '○○○○○'
-    elif 0 < value < 0.2:
-        #return '🟠⚪⚪⚪⚪'
-        return '●○○○○'
-    elif 0.2 <= value < 0.4:
-        #return '🟠🟠⚪⚪⚪'
-        return '●●○○○'
-    elif 0.4 <= value < 0.6:
-        #return '🟠🟠🟠⚪⚪'
-        return '●●●○○'
-    elif 0.6 <= value < 0.8:
-        #return '🟠🟠🟠🟠⚪'
-        return '●●●●○'
-    elif 0.8 <= value <= 1:
-        #return '🟠🟠🟠🟠🟠'
-        return '●●●●●'
-    else:
-        return 'None'  # In case the value is outside the expected range
+def show_results_page(search_results, column_order_config):
+    # Only the current page of results, and only the columns shown, are sent to the browser
+    number_of_pages = max(1, -(-len(search_results) // RESULTS_PAGE_SIZE))
+    results_page = min(max(st.session_state.results_page, 0), number_of_pages - 1)
+    st.session_state.results_page = results_page
+    page_start = results_page * RESULTS_PAGE_SIZE
+    page_end = min(page_start + RESULTS_PAGE_SIZE, len(search_results))
+
+    # If there are any NULL values in the numbers replace with 0
+    with metrics.time_stage('page'):
+        data_df = search_results.rows(page_start, page_end, column_order_config)
+        data_df = data_df.fillna({column: 0 for column in data_df.select_dtypes('number').columns})
+
+    # Configure the height of the table so that we do not have a scrollbar inside the table
+    height_config = 35 * len(data_df) + 38
+
+    # Load the data in a table
+    with metrics.time_stage('table'):
+        st.data_editor(
+            data_df,
+            column_order=column_order_config,
+            column_config={
+                "title": st.column_config.TextColumn(
+                    "Description",
+                    disabled=True
+                ),
+                "address": st.column_config.TextColumn(
+                    "Address",
+                    disabled=True
+                ),
+                "monthly_int": st.column_config.NumberColumn(
+                    "Rent",
+                    format="£ %d",
+                    disabled=True
+                ),
+                "platform": st.column_config.TextColumn(
+                    "Platform",
+                    width="small",
+                    disabled=True
+                ),
+                "link": st.column_config.LinkColumn(
+                    "Details",
+                    display_text="More ↗",
+                    width="small",
+                    disabled=True
+                ),
+                "agent_name": st.column_config.TextColumn(
+                    "Agency",
+                    disabled=True,
+                ),
+                "preferences_alignment": st.column_config.ProgressColumn(
+                    "Align Score",
+                    min_value = 0,
+                    max_value = 1,
+                    format="%.2f",
+                    width="small"
+                ),
+                "natural_light_smiley_face": st.column_config.TextColumn(
+                    "Natural Light",
+                    disabled=True,
+                    width="small"
+                ),
+                "large_windows_smiley_face": st.column_config.TextColumn(
+                    "Large Windows",
+                    disabled=True,
+                    width="small"
+                ),
+                "high_ceiling_smiley_face": st.column_config.TextColumn(
+                    "High Ceiling",
+                    disabled=True,
+                    width="small"
+                ),
+                "fireplace_smiley_face": st.column_config.TextColumn(
+                    "Fireplace",
+                    disabled=True,
+                    width="small"
+                ),
+                "no_carpet_smiley_face": st.column_config.TextColumn(
+                    "No Carpet",
+                    disabled=True,
+                    width="small"
+                ),
+                "wide_lenses_smiley_face": st.column_config.TextColumn(
+                    "No Wide Lenses",
+                    disabled=True,
+                    width="small"
+                ),
+                "overprocessed_smiley_face": st.column_config.TextColumn(
+                    "No Edited Photos",
+                    disabled=True,
+                    width="small"
+                ),
+            },
+            hide_index=True,
+            height=height_config,
+            use_container_width=True,
+            # The best results shown first are replaced by all of them in the same rerun
+            key=None if search_results.complete else "results_preview",
+        )
+
+    # The controls to browse the pages of results, once all the results are ranked
+    if not search_results.complete:
+        st.caption(f"Showing the best {page_end} results, ranking the rest of the {search_results.number_of_results}...")
+    elif number_of_pages > 1:
+        column_b1, column_b2, column_b3 = st.columns([0.2,0.6,0.2], vertical_alignment="center")
+        with column_b1:
+            st.button(":material/chevron_left: Previous", on_click=change_results_page, args=(-1,), disabled=results_page == 0, use_container_width=True)
+        with column_b2:
+            st.caption(f"Showing {page_start + 1}-{page_end} of {len(search_results)} results")
+        with column_b3:
+            st.button("Next :material/chevron_right:", on_click=change_results_page, args=(1,), disabled=results_page >= number_of_pages - 1, use_container_width=True)
 
 
-# Load the csv with the data
-df = pd.read_csv('data/properties.csv',  dtype={'property_id': 'str'}).sort_values(by='monthly_int', ascending=True)
 
+# The number of results shown per page of the results table
+RESULTS_PAGE_SIZE = 50
 
-# Add new columns with the score dots
-df['natural_light_smiley_face'] = df['natural_light_score'].apply(apply_face)
-df['large_windows_smiley_face'] = df['large_windows_score'].apply(apply_face)
-df['high_ceiling_smiley_face'] = df['high_ceiling_score'].apply(apply_face)
-df['fireplace_smiley_face'] = df['fireplace_score'].apply(apply_face)
-df['no_carpet_smiley_face'] = df['no_carpet_score'].apply(apply_face)
-df['wide_lenses_smiley_face'] = df['wide_lenses_score'].apply(apply_face)
-df['overprocessed_smiley_face'] = df['overprocessed_score'].apply(apply_face)
 
 # Get the creation date of the data file
 #data_file_creation_date = os.path.getctime('data/properties.csv')
 #creation_date_formatted = datetime.fromtimestamp(data_file_creation_date).strftime('%d %B %Y')
 
 
-# Configure the dictionary for features ordering
-features_dict = {
-    "Natural Light": ["natural_light_score", False, "natural_light_smiley_face"],
-    "Large Windows": ["large_windows_score", False, "large_windows_smiley_face"],
-    "High Ceiling": ["high_ceiling_score", False, "high_ceiling_smiley_face"],
-    "Fireplace": ["fireplace_score", False, "fireplace_smiley_face"],
-    "No Carpets": ["no_carpet_score", False, "no_carpet_smiley_face"],
-    "No Wide Lenses": ["wide_lenses_score", True, "wide_lenses_smiley_face"],
-    "No Edited Photos": ["overprocessed_score", True, "overprocessed_smiley_face"],
-}
-
-
 # Show the large banner or top title depending on journey
 st.markdown("## :blue[Home Match AI.] Discover a :blue[Home with Character.] Not Just the Basics.")
 
@@ -139,6 +232,7 @@ with st.container(border=True):
             show_only_top_rated_properties = st.toggle("Show only top-rated properties", value=False, help="Choose this option to filter out properties that may not meet your preferences.")
             exclude_zoopla = st.toggle("Hide Zoopla properties", value=False, help="Choose this option to exclude properties from Zoopla")
             exclude_rightmove = st.toggle("Hide Rightmove properties", value=False, help="Choose this option to exclude properties from Rightmove")
+            live_search = st.toggle("Live results", value=False, help="Choose this option to update the results as you change your preferences, without pressing Search")
     with column_a6:
         update_results = st.button(":material/search: Search", type="primary", on_click=main_button_click, use_container_width=True)
         
@@ -147,24 +241,43 @@ with st.container(border=True):
 # SHOW SEARCH RESULTS
 ###
 
-# If the search button is clicked
-if update_results:
-
-    # Set the search preferences to ok
-    search_preferences_ok = True
-
+# If the search button is clicked, or the preferences changed with live results
+show_results = False
+search_requested = update_results
+if update_results or live_search:
+
+    # The search engine, and the data it loads, are only imported once a search is made, so
+    # that the landing page renders without them
+    from search_engine import SearchPreferences, validate_preferences
+
+    search_preferences = SearchPreferences(
+        order_feature_options=tuple(order_feature_options),
+        number_of_bedrooms=number_of_bedrooms,
+        postcode=postcode,
+        min_monthly_rent=min_monthly_rent,
+        max_monthly_rent=max_monthly_rent,
+        exclude_enough_photos_overall=exclude_enough_photos_overall,
+        exclude_enough_bedroom_photos=exclude_enough_bedroom_photos,
+        exclude_room_to_rent=exclude_room_to_rent,
+        show_only_top_rated_properties=show_only_top_rated_properties,
+        exclude_zoopla=exclude_zoopla,
+        exclude_rightmove=exclude_rightmove,
+    ).normalized()
+
+    # With live results, any change of the preferences is a new search
+    if live_search and not update_results and search_preferences != st.session_state.get("results_search"):
+        search_requested = True
+        main_button_click()
+
+if search_requested:
 
     ###
     # CHECKS BEFORE LOADING THE RESULTS
     ###
 
-    if min_monthly_rent > max_monthly_rent:
-        st.error(f":material/error: The minimum monthly rent (£ {min_monthly_rent}) cannot be higher that the maximum monthly rent (£ {max_monthly_rent})")
-        search_preferences_ok = False
-    
-    if exclude_zoopla and exclude_rightmove:
-        st.error(f":material/error: Zoopla and Rightmove properties cannot be excluded at the same time. Please select at least one to proceed.")
-        search_preferences_ok = False
+    search_preferences_errors = validate_preferences(search_preferences)
+    for search_preferences_error in search_preferences_errors:
+        st.error(f":material/error: {search_preferences_error}")
 
 
 
@@ -172,202 +285,96 @@ if update_results:
     # IF THE PREFERENCES ARE OK, LOAD THE RESULTS
     ###
 
-    if search_preferences_ok:
+    if not search_preferences_errors:
 
-        # Filter the properties based on the preferences
-        filtered_df = df[(df['monthly_int'] >= min_monthly_rent) & (df['monthly_int'] <= max_monthly_rent)]
-        filtered_df = filtered_df[filtered_df['address'].str.contains(str(postcode).upper())]
-        filtered_df = filtered_df[filtered_df['bed_number'] == number_of_bedrooms]
+        # Remember the search, so that its results can be browsed page by page
+        st.session_state.results_search = search_preferences
+        st.session_state.results_page = 0
+        show_results = True
 
-        if exclude_enough_photos_overall:
-            filtered_df = filtered_df[filtered_df['number_of_photos_overall_score'] == 1]
-        else:
-            pass
+elif st.session_state.pop("results_page_changed", False):
+    # Another page of the results of the last search is requested
+    show_results = True
 
-        if exclude_enough_bedroom_photos:
-            filtered_df = filtered_df[filtered_df['number_of_bedroom_photos_score'] == 1]
-        else:
-            pass
+elif live_search and "results_search" in st.session_state:
+    # With live results the results of the last search stay on the page
+    show_results = True
 
-        if exclude_room_to_rent:
-            filtered_df = filtered_df[~filtered_df['title'].str.contains("Room to rent")]
-        else:
-            pass
+else:
+    if "first_search_done" not in st.session_state:
+        pass
+    else:
+        st.info("Preferences changed. Search again to refresh data!", icon=":material/change_circle:")
+
+
+if show_results:
+
+    from dataset import load_dataset
+    from search_engine import IncrementalSearch, search_progressively
+
+    search_preferences = st.session_state.results_search
+    searched_feature_options = search_preferences.order_feature_options
+
+    # Load the prepared data, shared by all sessions and reloaded only when the data file changes
+    with metrics.time_stage('load_dataset'):
+        dataset = load_dataset()
+
+    # Configure the order of the columms based on the selection of preferences
+    column_order_config = ("title","address","monthly_int","platform","link","agent_name")
+    if searched_feature_options:
+        for ordering in searched_feature_options:
+            column_order_config = column_order_config + (features_dict[ordering][2],)
+    else:
+        pass
 
-        if exclude_zoopla:
-            filtered_df = filtered_df[filtered_df['platform'] != "Zoopla"]
-        else:
-            pass
+    # The messages stay above the results, and the results are replaced once all of them are ranked
+    messages_container = st.container()
+    results_placeholder = st.empty()
 
-        if exclude_rightmove:
-            filtered_df = filtered_df[filtered_df['platform'] != "Rightmove"]
-        else:
-            pass
+    # The search engine reuses the results of the same search from the cache shared by all sessions,
+    # or the stages of the last search of this session that the changes of the preferences did not affect.
+    # On the first page the best results are shown first, while the rest of them are sorted
+    if "incremental_search" not in st.session_state:
+        st.session_state.incremental_search = IncrementalSearch()
+    first_results = RESULTS_PAGE_SIZE if st.session_state.results_page == 0 else None
+    # Only the searches just requested are counted, not the pages of a search or the reruns showing it again
+    search_progress = search_progressively(search_preferences, dataset, st.session_state.incremental_search, first_results, new_search=search_requested)
 
-        # If there are any NULL values replace with 0
-        filtered_df = filtered_df.fillna(0)
+    for search_step, search_results in enumerate(search_progress):
 
         # Check how may results have left after th estandard filtering
-        if len(filtered_df) == 0:
-            show_no_results_error()
-        elif len(filtered_df) >1500:
-            st.error(f":material/error: Your search returned {len(filtered_df)} results. Please refine your query to narrow down the results.")
-        else:
-
-            # Create a new column based on existing columns
-            if order_feature_options:
-
-                # The weight for the new columns is the number of preferences selection
-                weight = len(order_feature_options)
-
-                for ordering in order_feature_options:
-                    if 'preferences_alignment' in filtered_df:
-                        filtered_df['preferences_alignment'] = filtered_df['preferences_alignment'] + (filtered_df[features_dict[ordering][0]] * weight)
-                        weight -= 1
+        if search_results.number_of_results == 0:
+            with messages_container:
+                show_no_results_error()
+            continue
+
+        with messages_container:
+            # The messages about the preferences are shown once per search, not per page
+            if search_requested and search_step == 0:
+                if searched_feature_options:
+                    # Increase the counter for the searches with feature preferences
+                    if "number_of_feature_searches" not in st.session_state:
+                        st.session_state.number_of_feature_searches = 1
+                        with st.container(border=True):
+                            st.markdown("Here's a quick guide to help you understand **how well each property matches your preferences**:")
+                            #st.write("🟠⚪⚪⚪⚪: Minimal | 🟠🟠⚪⚪⚪: Slight | 🟠🟠🟠⚪⚪: Moderate | 🟠🟠🟠🟠⚪: Strong | 🟠🟠🟠🟠🟠: Excellent")
+                            st.write("●○○○○: Minimal | ●●○○○: Slight | ●●●○○: Moderate | ●●●●○: Strong | ●●●●●: Excellent")
                     else:
-                        filtered_df['preferences_alignment'] = filtered_df[features_dict[ordering][0]] * weight
-                        weight -= 1
-                
-                # Normalise the values to 1
-                max_value = filtered_df['preferences_alignment'].max()
-                if max_value > 1:
-                    filtered_df['preferences_alignment'] = filtered_df['preferences_alignment'] / max_value                  
-
-                # Order the list based on the new column for preferences alignment
-                filtered_df = filtered_df.sort_values(by='preferences_alignment', ascending=False)
-                
-                # Create new columns with smiley faces based on the scores
-                #filtered_df['natural_light_smiley_face'] = df['natural_light_score'].apply(apply_face)
-                #filtered_df['large_windows_smiley_face'] = df['large_windows_score'].apply(apply_face)
-                #filtered_df['high_ceiling_smiley_face'] = df['high_ceiling_score'].apply(apply_face)
-                #filtered_df['fireplace_smiley_face'] = df['fireplace_score'].apply(apply_face)
-                #filtered_df['no_carpet_smiley_face'] = df['no_carpet_score'].apply(apply_face)
-                #filtered_df['wide_lenses_smiley_face'] = df['wide_lenses_score'].apply(apply_face)
-                #filtered_df['overprocessed_smiley_face'] = df['overprocessed_score'].apply(apply_face)
-
-                # Increase the counter for the searches with feature preferences
-                if "number_of_feature_searches" not in st.session_state:
-                    st.session_state.number_of_feature_searches = 1
-                    with st.container(border=True):
-                        st.markdown("Here's a quick guide to help you understand **how well each property matches your preferences**:")
-                        #st.write("🟠⚪⚪⚪⚪: Minimal | 🟠🟠⚪⚪⚪: Slight | 🟠🟠🟠⚪⚪: Moderate | 🟠🟠🟠🟠⚪: Strong | 🟠🟠🟠🟠🟠: Excellent")
-                        st.write("●○○○○: Minimal | ●●○○○: Slight | ●●●○○: Moderate | ●●●●○: Strong | ●●●●●: Excellent")
+                        st.session_state.number_of_feature_searches += 1
+
                 else:
-                    st.session_state.number_of_feature_searches += 1
+                    # If no photo preferences selected
+                    if "number_of_feature_searches" not in st.session_state:
+                        st.info(f":material/info: Try selecting what you care the most in a home from the top menu and see how well each property matches your preferences.")
+                    else:
+                        pass
 
-                # If the option to filter to top-rated properties is selected
-                if show_only_top_rated_properties:
-                    filtered_df = filtered_df[filtered_df['preferences_alignment'] >= 0.7]
+        with results_placeholder.container():
+            show_results_page(search_results, column_order_config)
 
-            else:
-                # If no photo preferences selected
-                if "number_of_feature_searches" not in st.session_state:
-                    st.info(f":material/info: Try selecting what you care the most in a home from the top menu and see how well each property matches your preferences.")
-                else:
-                    pass
-
-            # Use the filtered results to load the table
-            data_df = pd.DataFrame(filtered_df)
-  
-            # Configure the order of the columms based on the selection of preferences
-            column_order_config = ("title","address","monthly_int","platform","link","agent_name")
-            if order_feature_options:         
-                for ordering in order_feature_options:
-                    column_order_config = column_order_config + (features_dict[ordering][2],)           
-            else:
-                pass
-
-            # Configure the height of the table so that we do not have a scrollbar inside the table
-            height_config = 35 * len(data_df) + 38
-
-            # Load the data in a table
-            st.data_editor(
-                data_df,
-                column_order=column_order_config,
-                column_config={
-                    "title": st.column_config.TextColumn(
-                        "Description",
-                        disabled=True
-                    ),
-                    "address": st.column_config.TextColumn(
-                        "Address",
-                        disabled=True
-                    ),
-                    "monthly_int": st.column_config.NumberColumn(
-                        "Rent",
-                        format="£ %d",
-                        disabled=True
-                    ),
-                    "platform": st.column_config.TextColumn(
-                        "Platform",
-                        width="small",
-                        disabled=True
-                    ),
-                    "link": st.column_config.LinkColumn(
-                        "Details",
-                        display_text="More ↗",
-                        width="small",
-                        disabled=True
-                    ),
-                    "agent_name": st.column_config.TextColumn(
-                        "Agency",
-                        disabled=True,
-                    ),
-                    "preferences_alignment": st.column_config.ProgressColumn(
-                        "Align Score",
-                        min_value = 0,
-                        max_value = 1,
-                        format="%.2f",
-                        width="small"
-                    ),
-                    "natural_light_smiley_face": st.column_config.TextColumn(
-                        "Natural Light",
-                        disabled=True,
-                        width="small"
-                    ),
-                    "large_windows_smiley_face": st.column_config.TextColumn(
-                        "Large Windows",
-                        disabled=True,
-                        width="small"
-                    ),
-                    "high_ceiling_smiley_face": st.column_config.TextColumn(
-                        "High Ceiling",
-                        disabled=True,
-                        width="small"
-                    ),
-                    "fireplace_smiley_face": st.column_config.TextColumn(
-                        "Fireplace",
-                        disabled=True,
-                        width="small"
-                    ),
-                    "no_carpet_smiley_face": st.column_config.TextColumn(
-                        "No Carpet",
-                        disabled=True,
-                        width="small"
-                    ),
-                    "wide_lenses_smiley_face": st.column_config.TextColumn(
-                        "No Wide Lenses",
-                        disabled=True,
-                        width="small"
-                    ),
-                    "overprocessed_smiley_face": st.column_config.TextColumn(
-                        "No Edited Photos",
-                        disabled=True,
-                        width="small"
-                    ),
-                },
-                hide_index=True,
-                height=height_config,
-                use_container_width=True,
-            )
-
-            # Show a message with the number of resutls returned
-            st.toast(f'{len(data_df)} results found.')
-else:
-    if "first_search_done" not in st.session_state:
-        pass
-    else:
-        st.info("Preferences changed. Search again to refresh data!", icon=":material/change_circle:")
+    # Show a message with the number of resutls returned
+    if search_requested and search_results.number_of_results > 0:
+        st.toast(f'{len(search_results)} results found.')
 
 
 # As landing page show the large banner and the smaller banners. After the first search they disappear
@@ -465,4 +472,12 @@ st.divider()
 st.image("images/logo/orbiont_logo.png", width=150) 
 #st.write(f"Data updated: {creation_date_formatted}")
 
-#st.session_state
\ No newline at end of file
+#st.session_state
+
+# Record the time of the whole rerun, and the time to the first render of the session and of the process
+metrics.observe_stage('rerun', time.perf_counter() - rerun_start_time)
+if first_session_rerun:
+    metrics.observe_stage('first_rerun', time.perf_counter() - rerun_start_time)
+metrics.record_first_render()
+if rerun_profile is not None:
+    stop_profile(rerun_profile)
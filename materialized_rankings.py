@@ -0,0 +1,138 @@
+import fcntl
+import json
+import os
+import threading
+from collections import Counter
+import numpy as np
+from ranking import preference_weights, rank_alignment, weighted_scores
+
+
+# The searches made with each ordering of the features, kept across restarts
+ORDERING_COUNTS_PATH = os.path.join('data', 'ordering_counts.json')
+
+# The most searched orderings are ranked ahead of time, each one holding 8 bytes per property
+MAX_MATERIALIZED_RANKINGS = 5
+
+# Picking the properties out of a ranking reads all of it, so it is only faster than scoring
+# them when the filters keep at least this share of the properties
+MIN_MATERIALIZED_SHARE = 0.05
+
+# The rankings are refreshed every this many searches with feature preferences
+REFRESH_INTERVAL = 500
+
+
+class MaterializedRanking:
+    """The alignment of every property with one ordering of the features, and their order.
+
+    The order is the one rank_alignment gives over all the properties, so the
+    properties matching some filters are in their own order in it too. A search
+    with the ordering only picks its properties out of it, without scoring or
+    sorting them.
+    """
+
+    def __init__(self, feature_scores, ordering):
+        self.ordering = ordering
+        self.alignment = weighted_scores(feature_scores, preference_weights(ordering))
+        self.order = rank_alignment(self.alignment).astype(np.int32)
+        self.nbytes = self.alignment.nbytes + self.order.nbytes
+
+    def rank(self, filtered_positions):
+        """Return the positions of the filtered properties in the order to show them, and their alignment."""
+        mask = np.zeros(len(self.order), dtype=bool)
+        mask[filtered_positions] = True
+        positions = self.order[mask[self.order]].astype(np.int64)
+        alignment = self.alignment[positions]
+
+        # Normalise the values to 1, the best aligned property comes first
+        max_value = alignment[0] if alignment.size else 0
+        if max_value > 1:
+            alignment = alignment / max_value
+            restore_rent_order(positions, alignment)
+
+        return positions, alignment
+
+
+def restore_rent_order(positions, alignment):
+    # Values that only differ before normalising can become equal, and properties with the
+    # same alignment are in rent order when scored on the fly. Only the runs of equal values
+    # that are out of order are sorted again, in place
+    equal = alignment[1:] == alignment[:-1]
+    misordered = equal & (positions[1:] < positions[:-1])
+    if not misordered.any():
+        return
+
+    runs = np.concatenate(([0], np.cumsum(~equal)))
+    members = np.flatnonzero(np.isin(runs, runs[1:][misordered]))
+    positions[members] = positions[members][np.lexsort((positions[members], runs[members]))]
+
+
+def read_ordering_counts(path):
+    # The counts saved in path, or none when it cannot be read
+    counts = Counter()
+    try:
+        with open(path) as counts_file:
+            for item in json.load(counts_file):
+                counts[tuple(item['ordering'])] += item['searches']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return counts
+
+
+class OrderingStats:
+    """The number of searches made with each ordering of the features.
+
+    The counts of the previous runs are read from path. When it saves them, this
+    process adds the searches it made since its last save to the counts in the
+    file, under a lock, so that the processes sharing the file add up their counts.
+    """
+
+    def __init__(self, path=ORDERING_COUNTS_PATH):
+        self.path = path
+        self.counts = read_ordering_counts(path)
+        # The searches of this process not yet added to the file
+        self.unsaved = Counter()
+        self.searches = 0
+        self._lock = threading.Lock()
+
+    def observe(self, ordering):
+        # Count a search, and tell whether the rankings are due to be refreshed
+        with self._lock:
+            self.counts[ordering] += 1
+            self.unsaved[ordering] += 1
+            self.searches += 1
+            return self.searches % REFRESH_INTERVAL == 0
+
+    def most_common(self, n=MAX_MATERIALIZED_RANKINGS):
+        with self._lock:
+            return [ordering for ordering, _ in self.counts.most_common(n)]
+
+    def save(self):
+        with self._lock:
+            unsaved, self.unsaved = self.unsaved, Counter()
+
+        try:
+            # The other processes read and write the file under the same lock, so that no save is lost
+            with open(f'{self.path}.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                counts = read_ordering_counts(self.path)
+                counts.update(unsaved)
+                items = [{'ordering': list(ordering), 'searches': searches} for ordering, searches in counts.most_common()]
+
+                # Written aside and renamed, so that the file is never read half written
+                build_path = f'{self.path}.build-{os.getpid()}'
+                with open(build_path, 'w') as counts_file:
+                    json.dump(items, counts_file)
+                os.replace(build_path, self.path)
+        except OSError:
+            # The searches are added by the next save
+            with self._lock:
+                self.unsaved.update(unsaved)
+            return
+
+        # The counts of the other processes are picked up with the file
+        with self._lock:
+            self.counts = counts + self.unsaved
+
+
+# The orderings searched in this process
+ordering_stats = OrderingStats()
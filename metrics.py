@@ -0,0 +1,229 @@
+import cProfile
+import logging
+import os
+import resource
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger('property_search.metrics')
+
+# The upper bounds of the histogram buckets, in seconds for the stages and in rows for the result sizes
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RESULT_SIZE_BUCKETS = (0, 10, 50, 100, 500, 1000, 1500, 5000, 10000, 50000)
+SESSION_RERUN_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+# The sessions whose reruns are counted, the least recently seen are forgotten first
+MAX_TRACKED_SESSIONS = 10000
+
+METRIC_PREFIX = 'property_search'
+
+# The time this module was imported, when the start time of the process is not known
+_import_time = time.time()
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[i] += 1
+
+    def render(self, name, labels=''):
+        separator = ',' if labels else ''
+        lines = [
+            f'{name}_bucket{{{labels}{separator}le="{upper_bound}"}} {count}'
+            for upper_bound, count in zip(self.buckets, self.counts)
+        ]
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    """The timings of the stages of the searches, and the counters of the app, for this process."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.result_sizes = Histogram(RESULT_SIZE_BUCKETS)
+        self.session_reruns = OrderedDict()
+        self.collectors = []
+        self.time_to_first_render = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time_stage(self, stage):
+        # Time the code of a stage of the pipeline
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start_time)
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram(STAGE_BUCKETS)
+            self.stages[stage].observe(seconds)
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def observe_result_size(self, number_of_results):
+        with self._lock:
+            self.result_sizes.observe(number_of_results)
+
+    def count_rerun(self, session_id):
+        # Count a rerun of the script for a session
+        with self._lock:
+            self.counters['reruns'] = self.counters.get('reruns', 0) + 1
+            self.session_reruns[session_id] = self.session_reruns.pop(session_id, 0) + 1
+            while len(self.session_reruns) > MAX_TRACKED_SESSIONS:
+                self.session_reruns.popitem(last=False)
+
+    def record_first_render(self):
+        # The seconds from the start of the process to the end of its first rerun
+        with self._lock:
+            if self.time_to_first_render is None:
+                self.time_to_first_render = process_age()
+                self.counters['time_to_first_render_seconds'] = self.time_to_first_render
+
+    def add_collector(self, collector):
+        # A function returning more counters to export, as a dict of names and values
+        self.collectors.append(collector)
+
+    def render_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [f'# TYPE {METRIC_PREFIX}_stage_seconds histogram']
+            for stage, histogram in sorted(self.stages.items()):
+                lines.extend(histogram.render(f'{METRIC_PREFIX}_stage_seconds', f'stage="{stage}"'))
+
+            lines.append(f'# TYPE {METRIC_PREFIX}_results histogram')
+            lines.extend(self.result_sizes.render(f'{METRIC_PREFIX}_results'))
+
+            session_reruns = Histogram(SESSION_RERUN_BUCKETS)
+            for reruns in self.session_reruns.values():
+                session_reruns.observe(reruns)
+            lines.append(f'# TYPE {METRIC_PREFIX}_session_reruns histogram')
+            lines.extend(session_reruns.render(f'{METRIC_PREFIX}_session_reruns'))
+
+            counters = dict(self.counters)
+
+        for collector in self.collectors:
+            counters.update(collector())
+        for counter, value in sorted(counters.items()):
+            lines.append(f'{METRIC_PREFIX}_{counter} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def process_age():
+    # The seconds since this process started
+    try:
+        with open('/proc/self/stat') as stat:
+            start_ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime:
+            uptime_seconds = float(uptime.read().split()[0])
+        return uptime_seconds - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.time() - _import_time
+
+
+def process_memory():
+    # The current and the peak resident memory of this process, in bytes
+    memory = {'process_peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open('/proc/self/statm') as statm:
+            memory['process_rss_bytes'] = int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        pass
+    return memory
+
+
+# The metrics of this process
+metrics = Metrics()
+metrics.add_collector(process_memory)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _flush_periodically(interval):
+    while True:
+        time.sleep(interval)
+        logger.info('metrics\n%s', metrics.render_prometheus())
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters():
+    """Start the exporters configured in the environment, once per process.
+
+    METRICS_PORT serves the metrics on http://<host>:METRICS_PORT/metrics, and
+    METRICS_LOG_INTERVAL logs them every that many seconds.
+    """
+    global _exporters_started
+
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+        port = os.environ.get('METRICS_PORT')
+        if port:
+            server = ThreadingHTTPServer((os.environ.get('METRICS_HOST', '127.0.0.1'), int(port)), MetricsRequestHandler)
+            threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+
+        interval = os.environ.get('METRICS_LOG_INTERVAL')
+        if interval:
+            threading.Thread(target=_flush_periodically, args=(float(interval),), name='metrics-log', daemon=True).start()
+
+
+def start_profile():
+    # A profiler for one rerun, only when PROFILE_DIR is set
+    if not os.environ.get('PROFILE_DIR'):
+        return None
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def stop_profile(profile, name='rerun'):
+    # Write the profile to PROFILE_DIR, to read with pstats or snakeviz
+    profile.disable()
+    profile_dir = os.environ['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.prof')
+    profile.dump_stats(path)
+    return path
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+
+# The outward code of a UK postcode (e.g. NW1, SW1A, E14), optionally followed by
+# the inward code, whose digit is the sector. The leading .* makes the last postcode
+# of the address win
+POSTCODE_PATTERN = r'.*\b([A-Z]{1,2}[0-9][A-Z0-9]?)(?:\s*([0-9])[A-Z]{2})?\b'
+
+# The postcode text input accepts up to 4 characters, as long as an outward code
+MAX_PREFIX_LENGTH = 4
+
+
+def extract_postcodes(addresses):
+    # The outward code and the sector found in each address, or empty strings when there are none
+    postcodes = addresses.str.upper().str.extract(POSTCODE_PATTERN, expand=True).fillna('')
+    return postcodes[0], postcodes[1]
+
+
+def extract_outward_codes(addresses):
+    # The outward code found in each address, or an empty string when there is none
+    return extract_postcodes(addresses)[0]
+
+
+def normalize_postcode(postcode):
+    # The postcode as typed, in the form used by the index. A space ends the outward code, so
+    # "E1 6" is the sector 6 of E1 rather than the start of E16, and "E1 " is only E1
+    postcode = str(postcode).upper().lstrip()
+    if not postcode.strip():
+        return ''
+
+    outward_code = postcode.split(None, 1)[0]
+    if outward_code == postcode:
+        return outward_code
+    return f"{outward_code} {''.join(postcode[len(outward_code):].split())}"
+
+
+class PostcodePrefixIndex:
+    """The positions of the rows for every prefix of their outward code.
+
+    Each outward code has at most four prefixes, so the index is a flat trie
+    and resolving a prefix is a single lookup. A postcode with a space is a
+    whole outward code, looked up on its own or with the sector after it.
+    Positions are kept in row order.
+    """
+
+    def __init__(self, outward_codes, sectors):
+        outward_codes = pd.Series(np.asarray(outward_codes, dtype=object), dtype=object)
+        sectors = pd.Series(np.asarray(sectors, dtype=object), dtype=object)
+        self.prefixes = {}
+
+        for length in range(1, MAX_PREFIX_LENGTH + 1):
+            # Codes shorter than the prefix length are left out of its groups
+            prefixes = outward_codes.str[:length].where(outward_codes.str.len() >= length)
+            for prefix, positions in prefixes.groupby(prefixes, sort=False).indices.items():
+                self.prefixes[prefix] = np.asarray(positions, dtype=np.int64)
+
+        # The whole outward codes, as "E1 ", and their sectors, as "E1 6"
+        known = outward_codes != ''
+        for keys in (outward_codes[known] + ' ', (outward_codes + ' ' + sectors)[known & (sectors != '')]):
+            for key, positions in keys.groupby(keys, sort=False).indices.items():
+                self.prefixes[key] = np.asarray(keys.index[positions], dtype=np.int64)
+
+    @classmethod
+    def from_prefixes(cls, prefixes):
+        # The index of positions already grouped by prefix
+        index = cls.__new__(cls)
+        index.prefixes = prefixes
+        return index
+
+    def lookup(self, postcode):
+        """Return the positions of the rows whose postcode starts with postcode."""
+        postcode = normalize_postcode(postcode)
+        if ' ' in postcode:
+            # Only the sector of the inward code is indexed
+            postcode = postcode[:postcode.index(' ') + 2]
+        return self.prefixes.get(postcode, np.empty(0, dtype=np.int64))
@@ -0,0 +1,59 @@
+import numpy as np
+from features import features_dict
+
+
+# The column of each feature in the feature score matrix
+FEATURE_POSITIONS = {feature: i for i, feature in enumerate(features_dict)}
+
+
+def preference_weights(order_feature_options):
+    # The weight of each feature is the number of preferences selected, minus its rank among them
+    weights = np.zeros(len(FEATURE_POSITIONS), dtype=np.float32)
+    weight = len(order_feature_options)
+    for ordering in order_feature_options:
+        weights[FEATURE_POSITIONS[ordering]] += weight
+        weight -= 1
+    return weights
+
+
+def weighted_scores(feature_scores, weights):
+    # The sum of the weighted scores of each row. It is added up feature by feature rather than
+    # with a matrix product, so that a row gets the same value whatever subset of the rows is scored.
+    # The BLAS product blocks its sums by the number of rows, which changed the last bits of some
+    # scores and so the order of the searches from the order of the materialized rankings
+    alignment = np.zeros(len(feature_scores), dtype=np.float32)
+    for column in np.flatnonzero(weights):
+        alignment += feature_scores[:, column] * weights[column]
+    return alignment
+
+
+def preferences_alignment(feature_scores, positions, weights):
+    """Return the alignment of the rows at positions with the preference weights.
+
+    The alignment is normalised to 1 when any row scores higher than 1.
+    """
+    alignment = weighted_scores(feature_scores[positions], weights)
+
+    max_value = alignment.max() if alignment.size else 0
+    if max_value > 1:
+        alignment = alignment / max_value
+
+    return alignment
+
+
+def rank_alignment(alignment, k=None):
+    """Return the order of the k best aligned rows, best first.
+
+    Rows with the same alignment keep their order, which is the order of the
+    rent. When only the top k rows are needed the rest are never sorted.
+    """
+    if k is None or k >= alignment.size:
+        return np.argsort(-alignment, kind='stable')
+
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Partition around the k-th best alignment and only sort the rows at or above it
+    threshold = np.partition(alignment, alignment.size - k)[alignment.size - k]
+    candidates = np.flatnonzero(alignment >= threshold)
+    return candidates[np.argsort(-alignment[candidates], kind='stable')][:k]
@@ -0,0 +1,240 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class ResultCache:
+    """A least recently used cache of search results, shared by all sessions.
+
+    Entries expire after ttl seconds and the cache is bounded both by the number
+    of entries and by the bytes of the cached arrays. All entries belong to one
+    dataset version and are dropped as soon as a different version is seen.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024, ttl=15 * 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        # A new dataset version makes every cached result stale
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.version = version
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key, version):
+        """Return the cached value for key, or None when it is not cached."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, value, size):
+        """Cache value for key, evicting the least recently used entries to make room."""
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the counters and the current size of the cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+class SharedResultCache:
+    """A cache of search results shared by the processes of a host, in a SQLite file.
+
+    It has the same interface and bounds as ResultCache, so that the Streamlit
+    processes behind one load balancer share their hit rate. The file is best kept
+    on a memory file system such as /dev/shm. Only one dataset version is kept, so
+    all the processes should serve the same version once a data drop is rolled out.
+
+    The values are the properties found by a search, the number of results and
+    the arrays of their positions and alignment. The arrays are stored as their
+    raw bytes and dtype, so nothing read from the file is ever unpickled.
+    """
+
+    def __init__(self, path, max_entries=2048, max_bytes=256 * 1024 * 1024, ttl=15 * 60):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # One connection for the process, used under a lock: Streamlit runs every rerun in a new
+        # thread, so a connection per thread would be opened again on nearly every rerun
+        self._connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._connection_lock = threading.Lock()
+        with self._connection_lock, self._connection as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS found_properties ('
+                'key TEXT PRIMARY KEY, version TEXT, number_of_results INTEGER, '
+                'positions BLOB, positions_dtype TEXT, alignment BLOB, alignment_dtype TEXT, '
+                'size INTEGER, expires REAL, used REAL)'
+            )
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key, version):
+        """Return the cached value for key, or None when it is not cached."""
+        now = time.time()
+        with self._connection_lock:
+            row = self._connection.execute(
+                'SELECT number_of_results, positions, positions_dtype, alignment, alignment_dtype FROM found_properties '
+                'WHERE key = ? AND version = ? AND expires >= ?', (repr(key), version, now)
+            ).fetchone()
+            if row is not None:
+                self._connection.execute('UPDATE found_properties SET used = ? WHERE key = ?', (now, repr(key)))
+
+        if row is None:
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        number_of_results, positions, positions_dtype, alignment, alignment_dtype = row
+        return number_of_results, array_from_bytes(positions, positions_dtype), array_from_bytes(alignment, alignment_dtype)
+
+    def put(self, key, version, value, size):
+        """Cache value for key, evicting the least recently used entries to make room."""
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        number_of_results, positions, alignment = value
+        with self._connection_lock, self._connection as connection:
+            connection.execute('BEGIN IMMEDIATE')
+
+            # A new dataset version makes every cached result stale
+            if connection.execute('DELETE FROM found_properties WHERE version != ?', (version,)).rowcount:
+                self._count('invalidations')
+            connection.execute('DELETE FROM found_properties WHERE expires < ?', (now,))
+
+            connection.execute(
+                'INSERT OR REPLACE INTO found_properties VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (repr(key), version, int(number_of_results), *array_to_bytes(positions), *array_to_bytes(alignment),
+                 size, now + self.ttl, now),
+            )
+
+            entries, total_bytes = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM found_properties').fetchone()
+            while entries > self.max_entries or total_bytes > self.max_bytes:
+                evicted_key, evicted_size = connection.execute(
+                    'SELECT key, size FROM found_properties ORDER BY used LIMIT 1'
+                ).fetchone()
+                connection.execute('DELETE FROM found_properties WHERE key = ?', (evicted_key,))
+                entries -= 1
+                total_bytes -= evicted_size
+                self._count('evictions')
+
+    def clear(self):
+        with self._connection_lock, self._connection as connection:
+            connection.execute('DELETE FROM found_properties')
+
+    def stats(self):
+        """Return the counters of this process and the current size of the shared cache."""
+        with self._connection_lock:
+            entries, total_bytes = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM found_properties'
+            ).fetchone()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': entries,
+                'bytes': total_bytes,
+            }
+
+
+def array_to_bytes(array):
+    # The raw bytes of a one-dimensional array and the name of its dtype, or None for both without an array
+    if array is None:
+        return None, None
+    array = np.ascontiguousarray(array)
+    return array.tobytes(), array.dtype.str
+
+
+def array_from_bytes(data, dtype):
+    # The read-only array of the raw bytes of array_to_bytes
+    if data is None:
+        return None
+    dtype = np.dtype(dtype)
+    if dtype.hasobject:
+        raise ValueError(f'Cannot read an array of {dtype} from raw bytes')
+    return np.frombuffer(data, dtype=dtype)
+
+
+def make_result_cache():
+    # The cache shared by the processes of the host when RESULT_CACHE_PATH is set, a cache
+    # of this process otherwise
+    path = os.environ.get('RESULT_CACHE_PATH')
+    if path:
+        return SharedResultCache(path)
+    return ResultCache()
+
+
+# The cache of the search results of this process, or of all the processes of the host
+search_results_cache = make_result_cache()
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs, urlsplit
+from dataset import load_dataset
+from materialized_rankings import ordering_stats
+from metrics import metrics
+from search_engine import SearchPreferences, search, similar_properties, validate_preferences
+
+
+# The columns of the properties returned by the API
+API_COLUMNS = (
+    "property_id", "title", "address", "monthly_int", "bed_number", "platform", "link", "agent_name",
+    "natural_light_score", "large_windows_score", "high_ceiling_score", "fireplace_score",
+    "no_carpet_score", "wide_lenses_score", "overprocessed_score",
+)
+
+# The number of properties returned when the request does not ask for a limit, and the most it can ask for
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# The number of similar homes returned when the request does not ask for a limit
+DEFAULT_SIMILAR_LIMIT = 10
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+# The search over the shards of the dataset, when the API serves them
+sharded_search = None
+
+logger = logging.getLogger('property_search.api')
+
+
+class BadRequest(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def parse_preferences(query):
+    # The search preferences of the query string of a request, on top of the defaults of the search form
+    values = parse_qs(query)
+    preferences = SearchPreferences()
+
+    try:
+        for field, default in preferences._asdict().items():
+            if field not in values:
+                continue
+            if field == 'order_feature_options':
+                value = tuple(values[field])
+            elif isinstance(default, bool):
+                value = values[field][-1].lower() in TRUE_VALUES
+            elif isinstance(default, int):
+                value = int(values[field][-1])
+            else:
+                value = values[field][-1]
+            preferences = preferences._replace(**{field: value})
+
+        offset = max(int(values.get('offset', ['0'])[-1]), 0)
+        limit = min(max(int(values.get('limit', [str(DEFAULT_LIMIT)])[-1]), 0), MAX_LIMIT)
+    except ValueError as error:
+        raise BadRequest(str(error))
+
+    return preferences, offset, limit
+
+
+def search_response(query):
+    # The body of the response to a search, run outside the event loop
+    preferences, offset, limit = parse_preferences(query)
+
+    errors = validate_preferences(preferences)
+    if errors:
+        raise BadRequest(' '.join(errors))
+
+    if sharded_search is not None:
+        # The shards return their best properties up to the end of the page, merged
+        number_of_results, total, rows = sharded_search.search(preferences, offset + limit)
+        rows = rows.iloc[offset:offset + limit]
+        rows = rows[[column for column in API_COLUMNS + ('preferences_alignment',) if column in rows]]
+        dataset_version = 'shards'
+    else:
+        # The next pages of a search are not counted as searches of their own
+        results = search(preferences, new_search=offset == 0)
+        columns = API_COLUMNS + (('preferences_alignment',) if results.alignment is not None else ())
+        rows = results.rows(offset, offset + limit, columns)
+        number_of_results, total, dataset_version = results.number_of_results, len(results), results.dataset.version
+
+    return {
+        'dataset_version': dataset_version,
+        'number_of_results': number_of_results,
+        'total': total,
+        'offset': offset,
+        'properties': json.loads(rows.to_json(orient='records')),
+    }
+
+
+def similar_response(query):
+    # The body of the response to a similar homes search, run outside the event loop
+    values = parse_qs(query)
+    if 'property_id' not in values:
+        raise BadRequest('property_id is required')
+    property_id = values['property_id'][-1]
+
+    try:
+        limit = min(max(int(values.get('limit', [str(DEFAULT_SIMILAR_LIMIT)])[-1]), 0), MAX_LIMIT)
+        rent_band = int(values['rent_band'][-1]) if 'rent_band' in values else None
+    except ValueError as error:
+        raise BadRequest(str(error))
+
+    try:
+        results, distances = similar_properties(property_id, k=limit, rent_band=rent_band)
+    except KeyError:
+        raise NotFound(f'Unknown property {property_id}')
+
+    rows = results.rows(columns=API_COLUMNS).assign(distance=distances)
+    return {
+        'dataset_version': results.dataset.version,
+        'property_id': property_id,
+        'properties': json.loads(rows.to_json(orient='records')),
+    }
+
+
+async def respond(writer, status, body, content_type='application/json'):
+    payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+    writer.write(
+        f'HTTP/1.1 {status}\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-Length: {len(payload)}\r\n'
+        f'Connection: close\r\n\r\n'.encode() + payload
+    )
+    await writer.drain()
+
+
+async def handle_request(reader, writer):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+
+        # The headers are not used
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        if len(request_line) < 2 or request_line[0] != 'GET':
+            await respond(writer, '405 Method Not Allowed', {'error': 'Only GET requests are supported'})
+            return
+
+        url = urlsplit(request_line[1])
+        if url.path == '/metrics':
+            await respond(writer, '200 OK', metrics.render_prometheus(), 'text/plain; version=0.0.4')
+            return
+
+        routes = {'/search': search_response, '/similar': similar_response}
+        if url.path not in routes:
+            await respond(writer, '404 Not Found', {'error': f'Unknown path {url.path}'})
+            return
+
+        try:
+            body = await asyncio.get_running_loop().run_in_executor(None, routes[url.path], url.query)
+        except BadRequest as error:
+            await respond(writer, '400 Bad Request', {'error': str(error)})
+            return
+        except NotFound as error:
+            await respond(writer, '404 Not Found', {'error': str(error)})
+            return
+        except Exception:
+            # The client gets an answer rather than a closed connection, the details stay in the log
+            logger.exception('Could not answer %s', request_line[1])
+            await respond(writer, '500 Internal Server Error', {'error': 'Internal server error'})
+            return
+
+        await respond(writer, '200 OK', body)
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    # Load the dataset and rank the most searched orderings before accepting requests, so that the first searches do not pay for it
+    orderings = ordering_stats.most_common()
+    if sharded_search is None and orderings:
+        load_dataset().materialize_rankings(orderings)
+
+    server = await asyncio.start_server(handle_request, host, port)
+    print(f'Serving the search API on http://{host}:{port}/search')
+    async with server:
+        await server.serve_forever()
+
+
+# Serve the search engine over HTTP, without Streamlit
+#
+#   python search_api.py [--host 127.0.0.1] [--port 8000] [--shards data/shards]
+#   curl 'http://127.0.0.1:8000/search?number_of_bedrooms=2&postcode=NW&order_feature_options=Natural+Light'
+#   curl 'http://127.0.0.1:8000/similar?property_id=123456789&rent_band=200'
+#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the property search over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--shards', help='Search the shards in this directory with a pool of processes')
+    parser.add_argument('--workers', type=int, help='The processes searching the shards')
+    args = parser.parse_args()
+
+    if args.shards:
+        from sharded_search import ShardedSearch
+        sharded_search = ShardedSearch(args.shards, args.workers)
+
+    asyncio.run(serve(args.host, args.port))
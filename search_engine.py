@@ -0,0 +1,356 @@
+import threading
+import time
+import weakref
+from typing import NamedTuple
+from dataset import load_dataset
+from features import features_dict
+from materialized_rankings import MIN_MATERIALIZED_SHARE, ordering_stats
+from metrics import metrics
+from postcodes import normalize_postcode
+from ranking import preference_weights, preferences_alignment, rank_alignment
+from result_cache import search_results_cache
+
+
+# The properties with at least this preferences alignment are the top-rated ones
+TOP_RATED_ALIGNMENT = 0.7
+
+# The stages of a search whose outputs are kept for the next search of a session, in the order they run
+INCREMENTAL_STAGES = ('filter', 'platforms', 'score', 'sort')
+
+# The most bytes of stage outputs a session keeps, the outputs that do not fit are computed again
+MAX_INCREMENTAL_BYTES = 16 * 1024 * 1024
+
+
+class SearchPreferences(NamedTuple):
+    # The preferences of a search, with the defaults of the search form
+    order_feature_options: tuple = ()
+    number_of_bedrooms: int = 1
+    postcode: str = ''
+    min_monthly_rent: int = 800
+    max_monthly_rent: int = 1200
+    exclude_enough_photos_overall: bool = True
+    exclude_enough_bedroom_photos: bool = True
+    exclude_room_to_rent: bool = True
+    show_only_top_rated_properties: bool = False
+    exclude_zoopla: bool = False
+    exclude_rightmove: bool = False
+
+    def normalized(self):
+        # The same search always has the same preferences, whatever the way it was typed
+        return self._replace(
+            order_feature_options=tuple(self.order_feature_options),
+            postcode=normalize_postcode(self.postcode),
+        )
+
+    def excluded_platforms(self):
+        excluded_platforms = []
+        if self.exclude_zoopla:
+            excluded_platforms.append("Zoopla")
+        if self.exclude_rightmove:
+            excluded_platforms.append("Rightmove")
+        return excluded_platforms
+
+
+class SearchResults:
+    """The properties found by a search, in the order to show them.
+
+    number_of_results is the number of properties matching the filters, before
+    the top-rated ones are picked. Rows are materialized a slice at a time.
+    """
+
+    def __init__(self, dataset, number_of_results, positions, alignment, complete=True):
+        self.dataset = dataset
+        self.number_of_results = number_of_results
+        self.positions = positions
+        self.alignment = alignment
+        # Whether all the results are there, or only the best of them while the others are sorted
+        self.complete = complete
+
+    def __len__(self):
+        return len(self.positions)
+
+    def rows(self, start=0, stop=None, columns=None):
+        # The frame of the results from start to stop, with only the columns given
+        rows = self.dataset.rows(self.positions[start:stop])
+        if self.alignment is not None:
+            rows = rows.assign(preferences_alignment=self.alignment[start:stop])
+        if columns is not None:
+            rows = rows[list(columns)]
+
+        # The categories of the shared frame are given back as plain values
+        return rows.astype({column: object for column in rows.select_dtypes('category').columns})
+
+
+def validate_preferences(preferences):
+    """Return the reasons why the preferences cannot be searched, if any."""
+    errors = []
+
+    if preferences.min_monthly_rent > preferences.max_monthly_rent:
+        errors.append(f"The minimum monthly rent (£ {preferences.min_monthly_rent}) cannot be higher that the maximum monthly rent (£ {preferences.max_monthly_rent})")
+
+    if preferences.exclude_zoopla and preferences.exclude_rightmove:
+        errors.append("Zoopla and Rightmove properties cannot be excluded at the same time. Please select at least one to proceed.")
+
+    unknown_features = [feature for feature in preferences.order_feature_options if feature not in features_dict]
+    if unknown_features:
+        errors.append(f"Unknown features: {', '.join(unknown_features)}")
+
+    return errors
+
+
+class IncrementalSearch:
+    """The outputs of the stages of the last search, reused by the next one.
+
+    A stage is only computed again when one of its inputs changed, so reordering
+    the features only ranks the filtered properties again, and excluding a
+    platform only masks the properties of the previous filters. Computing a stage
+    again drops the outputs of the stages after it, and outputs are only kept up
+    to max_bytes per session.
+    """
+
+    def __init__(self, max_bytes=MAX_INCREMENTAL_BYTES):
+        self.stages = {}
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        with _incremental_searches_lock:
+            _incremental_searches.add(self)
+
+    def has(self, name, key):
+        last = self.stages.get(name)
+        return last is not None and last[0] == key
+
+    def stage(self, name, key, compute):
+        if self.has(name, key):
+            return self.stages[name][1]
+
+        # The outputs of this stage and the later ones were made from other inputs
+        for later_name in INCREMENTAL_STAGES[INCREMENTAL_STAGES.index(name):]:
+            if later_name in self.stages:
+                self.nbytes -= self.stages.pop(later_name)[2]
+
+        value = compute()
+        # The arrays passed through from an earlier stage, such as the positions when no platform is excluded, are only counted once
+        held = {id(array) for _, stage_value, _ in self.stages.values() for array in stage_arrays(stage_value)}
+        size = sum(array.nbytes for array in stage_arrays(value) if id(array) not in held)
+        if self.nbytes + size <= self.max_bytes:
+            self.stages[name] = (key, value, size)
+            self.nbytes += size
+        return value
+
+
+def stage_arrays(value):
+    # The arrays of the output of a stage, an array or a tuple of arrays
+    return value if isinstance(value, tuple) else (value,)
+
+
+# The incremental searches of the sessions of this process, for the memory they hold
+_incremental_searches = weakref.WeakSet()
+_incremental_searches_lock = threading.Lock()
+
+
+def incremental_search_bytes():
+    with _incremental_searches_lock:
+        return sum(incremental.nbytes for incremental in _incremental_searches)
+
+
+def compute_stage(name, key, compute):
+    # The stages of a search without reuse
+    return compute()
+
+
+def filter_properties(dataset, preferences):
+    # Filter the properties based on the preferences, using the indexes built at load time
+    with metrics.time_stage('filter'):
+        return dataset.index.filter_positions(
+            preferences.min_monthly_rent,
+            preferences.max_monthly_rent,
+            preferences.postcode,
+            preferences.number_of_bedrooms,
+            exclude_enough_photos_overall=preferences.exclude_enough_photos_overall,
+            exclude_enough_bedroom_photos=preferences.exclude_enough_bedroom_photos,
+            exclude_room_to_rent=preferences.exclude_room_to_rent,
+        )
+
+
+def exclude_platforms(dataset, positions, preferences):
+    with metrics.time_stage('filter_platforms'):
+        return dataset.index.exclude_platforms(positions, preferences.excluded_platforms())
+
+
+def score_properties(dataset, filtered_positions, preferences):
+    # Score the properties against the preferences, adding up the weighted columns of the score matrix
+    with metrics.time_stage('score'):
+        weights = preference_weights(preferences.order_feature_options)
+        return preferences_alignment(dataset.feature_scores, filtered_positions, weights)
+
+
+def sort_properties(filtered_positions, alignment, k=None):
+    # Order the list based on the preferences alignment
+    with metrics.time_stage('sort' if k is None else 'sort_first'):
+        order = rank_alignment(alignment, k)
+        return filtered_positions[order], alignment[order]
+
+
+def rank_materialized(ranking, filtered_positions):
+    # Pick the properties out of the ranking made ahead of time for their ordering
+    with metrics.time_stage('rank_materialized'):
+        return ranking.rank(filtered_positions)
+
+
+def pick_top_rated(result_positions, result_alignment, preferences):
+    # If the option to filter to top-rated properties is selected
+    if preferences.show_only_top_rated_properties:
+        top_rated = result_alignment >= TOP_RATED_ALIGNMENT
+        return result_positions[top_rated], result_alignment[top_rated]
+    return result_positions, result_alignment
+
+
+def find_properties_progressively(dataset, preferences, incremental=None, first=None):
+    # Yields the number of properties matching the filters, and the positions in the frame of the
+    # properties to show with their preferences alignment, in the order to show them. When first is
+    # given, the best first properties are yielded before all of them are sorted
+    stage = incremental.stage if incremental is not None else compute_stage
+
+    filter_key = (
+        dataset.version,
+        preferences.min_monthly_rent,
+        preferences.max_monthly_rent,
+        preferences.postcode,
+        preferences.number_of_bedrooms,
+        preferences.exclude_enough_photos_overall,
+        preferences.exclude_enough_bedroom_photos,
+        preferences.exclude_room_to_rent,
+    )
+    platforms_key = filter_key + (preferences.exclude_zoopla, preferences.exclude_rightmove)
+    rank_key = platforms_key + (preferences.order_feature_options,)
+
+    positions = stage('filter', filter_key, lambda: filter_properties(dataset, preferences))
+    filtered_positions = stage('platforms', platforms_key, lambda: exclude_platforms(dataset, positions, preferences))
+
+    # Without results or feature preferences there is nothing to rank
+    if len(filtered_positions) == 0 or not preferences.order_feature_options:
+        yield len(filtered_positions), filtered_positions, None
+        return
+
+    # The popular orderings are ranked ahead of time, when the filters keep enough properties for it to pay off
+    ranking = (dataset.rankings or {}).get(preferences.order_feature_options)
+    if ranking is not None and len(filtered_positions) >= MIN_MATERIALIZED_SHARE * len(dataset):
+        sorted_properties = stage('sort', rank_key, lambda: rank_materialized(ranking, filtered_positions))
+        yield (len(filtered_positions),) + pick_top_rated(*sorted_properties, preferences)
+        return
+
+    alignment = stage('score', rank_key, lambda: score_properties(dataset, filtered_positions, preferences))
+
+    # The best properties only need a partial sort, shown while the others are sorted
+    sorted_before = incremental is not None and incremental.has('sort', rank_key)
+    if first is not None and first < len(filtered_positions) and not sorted_before:
+        yield (len(filtered_positions),) + pick_top_rated(*sort_properties(filtered_positions, alignment, first), preferences)
+
+    sorted_properties = stage('sort', rank_key, lambda: sort_properties(filtered_positions, alignment))
+    yield (len(filtered_positions),) + pick_top_rated(*sorted_properties, preferences)
+
+
+def find_properties(dataset, preferences, incremental=None):
+    for found_properties in find_properties_progressively(dataset, preferences, incremental):
+        pass
+    return found_properties
+
+
+def found_properties_size(found_properties):
+    # The bytes held by the properties found by a search in the cache
+    _, result_positions, result_alignment = found_properties
+    return result_positions.nbytes + (result_alignment.nbytes if result_alignment is not None else 0)
+
+
+# Only one refresh of the rankings runs at a time
+_rankings_refresh = threading.Lock()
+
+
+def refresh_rankings(dataset):
+    # Rank the properties for the most searched orderings in the background, and save the counts of the searches
+    if not _rankings_refresh.acquire(blocking=False):
+        return
+
+    def refresh():
+        try:
+            ordering_stats.save()
+            dataset.materialize_rankings(ordering_stats.most_common())
+        finally:
+            _rankings_refresh.release()
+
+    threading.Thread(target=refresh, name='materialize-rankings', daemon=True).start()
+
+
+def search_progressively(preferences, dataset=None, incremental=None, first=None, new_search=True):
+    """Yield the results of a search, the best first of them before all of them when they need sorting.
+
+    The last results yielded are complete, and only those are cached. Without
+    first, or when the search is cached, the complete results are the only ones
+    yielded. Only new searches are counted, not the results of a search shown
+    again, such as another page of them. The preferences must be valid, see
+    validate_preferences.
+    """
+    if dataset is None:
+        dataset = load_dataset()
+    preferences = preferences.normalized()
+
+    # The orderings searched the most get their rankings made ahead of time
+    if preferences.order_feature_options:
+        observed = new_search and ordering_stats.observe(preferences.order_feature_options)
+        if observed or not dataset.rankings:
+            refresh_rankings(dataset)
+
+    # The time spent showing the first results is not part of the search
+    search_seconds = 0.0
+    start_time = time.perf_counter()
+    found_properties = search_results_cache.get(preferences, dataset.version)
+    if found_properties is None:
+        found = find_properties_progressively(dataset, preferences, incremental, first)
+        found_properties = next(found)
+        for complete_properties in found:
+            search_seconds += time.perf_counter() - start_time
+            yield SearchResults(dataset, *found_properties, complete=False)
+            start_time = time.perf_counter()
+            found_properties = complete_properties
+        search_results_cache.put(preferences, dataset.version, found_properties, found_properties_size(found_properties))
+    metrics.observe_stage('search', search_seconds + time.perf_counter() - start_time)
+
+    search_results = SearchResults(dataset, *found_properties)
+    if new_search:
+        metrics.increment('searches')
+        metrics.observe_result_size(len(search_results))
+    yield search_results
+
+
+def search(preferences, dataset=None, incremental=None, new_search=True):
+    """Return the results of a search, reusing the results of the same search when cached.
+
+    When the search is not cached, the stages of the last search made with
+    incremental are reused where their inputs did not change. The preferences
+    must be valid, see validate_preferences.
+    """
+    for search_results in search_progressively(preferences, dataset, incremental, new_search=new_search):
+        pass
+    return search_results
+
+
+def similar_properties(property_id, dataset=None, k=10, rent_band=None):
+    """Return the results of the k properties most like a property, and their distances in feature score space.
+
+    With a rent band, only the properties whose rent is at most that far from the
+    rent of the property are returned. Raises KeyError when the property is unknown.
+    """
+    if dataset is None:
+        dataset = load_dataset()
+
+    with metrics.time_stage('similar'):
+        similar_homes = dataset.similar_homes
+        positions, distances = similar_homes.nearest(similar_homes.position(property_id), k, rent_band)
+
+    metrics.increment('similar_searches')
+    return SearchResults(dataset, len(positions), positions, None), distances
+
+
+# Export the counters of the result cache, and the memory held by the incremental searches, with the other metrics
+metrics.add_collector(lambda: {f'result_cache_{name}': value for name, value in search_results_cache.stats().items()})
+metrics.add_collector(lambda: {'incremental_search_bytes': incremental_search_bytes()})
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+from postcodes import PostcodePrefixIndex, normalize_postcode
+
+
+class SearchIndex:
+    """Filter indexes over the rows of a prepared properties frame.
+
+    The frame is sorted by monthly_int, so a rent range is a contiguous run of
+    positions. Every other filter narrows that run down, and searches only ever
+    return positions so that the caller materializes the frame once.
+    """
+
+    def __init__(self, df):
+        self.size = len(df)
+
+        # The sorted rent of every row, searched with binary search
+        self.monthly_rent = df['monthly_int'].to_numpy()
+
+        # The positions of the rows for each number of bedrooms, in rent order
+        self.bedroom_groups = {
+            value: np.asarray(positions, dtype=np.int64)
+            for value, positions in df.groupby('bed_number', sort=False).indices.items()
+        }
+
+        # The platform of every row as a category code, and the positions of each platform
+        platform_codes, platforms = pd.factorize(df['platform'])
+        self.platform_codes = platform_codes
+        self.platform_code_by_name = {platform: code for code, platform in enumerate(platforms)}
+        self.platform_groups = {
+            platform: np.flatnonzero(platform_codes == code)
+            for platform, code in self.platform_code_by_name.items()
+        }
+
+        # The flags of the filters that do not depend on the search preferences
+        self.enough_photos_overall = (df['number_of_photos_overall_score'] == 1).to_numpy()
+        self.enough_bedroom_photos = (df['number_of_bedroom_photos_score'] == 1).to_numpy()
+        self.room_to_rent = df['title'].str.contains("Room to rent", regex=False, na=False).to_numpy()
+
+        # The positions of the rows for each prefix of the outward code of their postcode, and for each sector
+        self.postcodes = PostcodePrefixIndex(df['outward_code'], df['postcode_sector'])
+
+    def patched(self, old_to_new, new_positions, delta_df):
+        """Return the index of the next version of the rows, patched from this one.
+
+        old_to_new is the next position of each row of this index, or -1 when the
+        row is dropped, and the rows of delta_df, in rent order, go to new_positions.
+        Only the rows of delta_df are indexed, the rest is moved.
+        """
+        delta_index = SearchIndex(delta_df)
+        index = SearchIndex.__new__(SearchIndex)
+        index.size = int(np.count_nonzero(old_to_new >= 0)) + len(new_positions)
+
+        def rows(values, delta_values):
+            return merge_rows(values, delta_values, old_to_new, new_positions)
+
+        def groups(position_groups, delta_position_groups):
+            return merge_groups(position_groups, delta_position_groups, old_to_new, new_positions)
+
+        index.monthly_rent = rows(self.monthly_rent, delta_index.monthly_rent)
+        index.bedroom_groups = groups(self.bedroom_groups, delta_index.bedroom_groups)
+
+        # New platforms get the next codes, and the codes of the delta are translated to these
+        index.platform_code_by_name = dict(self.platform_code_by_name)
+        for platform in delta_index.platform_code_by_name:
+            index.platform_code_by_name.setdefault(platform, len(index.platform_code_by_name))
+        codes = np.array([index.platform_code_by_name[platform] for platform in delta_index.platform_code_by_name] + [-1], dtype=np.intp)
+        index.platform_codes = rows(self.platform_codes, codes[delta_index.platform_codes])
+        index.platform_groups = groups(self.platform_groups, delta_index.platform_groups)
+
+        index.enough_photos_overall = rows(self.enough_photos_overall, delta_index.enough_photos_overall)
+        index.enough_bedroom_photos = rows(self.enough_bedroom_photos, delta_index.enough_bedroom_photos)
+        index.room_to_rent = rows(self.room_to_rent, delta_index.room_to_rent)
+
+        index.postcodes = PostcodePrefixIndex.from_prefixes(groups(self.postcodes.prefixes, delta_index.postcodes.prefixes))
+        return index
+
+    def rent_range(self, min_monthly_rent, max_monthly_rent):
+        # The first and last position (exclusive) of the rows inside the rent range
+        start = np.searchsorted(self.monthly_rent, min_monthly_rent, side='left')
+        stop = np.searchsorted(self.monthly_rent, max_monthly_rent, side='right')
+        return start, max(start, stop)
+
+    def filter_positions(self, min_monthly_rent, max_monthly_rent, postcode, number_of_bedrooms,
+                         exclude_enough_photos_overall=False, exclude_enough_bedroom_photos=False,
+                         exclude_room_to_rent=False, excluded_platforms=()):
+        """Return the positions of the rows that match the search preferences, in rent order."""
+        start, stop = self.rent_range(min_monthly_rent, max_monthly_rent)
+
+        # The bedroom group is in rent order too, so the rent range is a slice of it
+        group = self.bedroom_groups.get(number_of_bedrooms)
+        if group is None:
+            return np.empty(0, dtype=np.int64)
+        positions = group[np.searchsorted(group, start):np.searchsorted(group, stop)]
+
+        # The postcode prefix resolves to its rows with one lookup
+        postcode = normalize_postcode(postcode)
+        if postcode and positions.size:
+            positions = np.intersect1d(positions, self.postcodes.lookup(postcode), assume_unique=True)
+
+        if exclude_enough_photos_overall:
+            positions = positions[self.enough_photos_overall[positions]]
+
+        if exclude_enough_bedroom_photos:
+            positions = positions[self.enough_bedroom_photos[positions]]
+
+        if exclude_room_to_rent:
+            positions = positions[~self.room_to_rent[positions]]
+
+        return self.exclude_platforms(positions, excluded_platforms)
+
+    def exclude_platforms(self, positions, excluded_platforms):
+        """Return the positions without the rows of the excluded platforms."""
+        for platform in excluded_platforms:
+            code = self.platform_code_by_name.get(platform)
+            if code is not None:
+                positions = positions[self.platform_codes[positions] != code]
+
+        return positions
+
+
+def merge_rows(values, delta_values, old_to_new, new_positions):
+    """Return the values of the rows of the next version, moved from values and delta_values.
+
+    The rows of values go to old_to_new, leaving out the ones at -1, and the rows
+    of delta_values go to new_positions.
+    """
+    kept = old_to_new >= 0
+    merged = np.empty((int(np.count_nonzero(kept)) + len(new_positions),) + values.shape[1:],
+                      dtype=np.result_type(values, delta_values))
+    merged[old_to_new[kept]] = values[kept]
+    merged[new_positions] = delta_values
+    return merged
+
+
+def merge_groups(groups, delta_groups, old_to_new, new_positions):
+    # The positions of each group in the next version, still in rent order, without the groups left empty
+    empty = np.empty(0, dtype=np.int64)
+    merged = {}
+    for key in groups.keys() | delta_groups.keys():
+        moved = old_to_new[groups.get(key, empty)]
+        positions = np.sort(np.concatenate([moved[moved >= 0], new_positions[delta_groups.get(key, empty)]]))
+        if positions.size:
+            merged[key] = positions
+    return merged
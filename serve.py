@@ -0,0 +1,44 @@
+import argparse
+import sys
+import time
+
+
+# Start the app with the dataset already loaded and indexed, so that the first sessions do
+# not wait for it. Any other arguments are passed to streamlit run
+#
+#   python serve.py [--no-warmup] [-- --server.port 8501]
+#
+# When several servers run on one host, they share the prepared arrays and the search results with
+#
+#   SHARED_ARRAYS_PATH=/dev/shm/property_search RESULT_CACHE_PATH=/dev/shm/property_search/results.db python serve.py
+#
+# and the columnar dataset built by build_dataset.py is mapped from the same page cache by all of them
+#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Warm up the dataset, then serve the app.')
+    parser.add_argument('--no-warmup', action='store_true', help='Start the server without loading the dataset first')
+    args, streamlit_args = parser.parse_known_args()
+    if streamlit_args[:1] == ['--']:
+        streamlit_args = streamlit_args[1:]
+
+    if not args.no_warmup:
+        start_time = time.perf_counter()
+
+        # The server runs the app in this process, so the app finds the dataset and the
+        # cached result of the default search already in memory
+        from dataset import load_dataset
+        from materialized_rankings import ordering_stats
+        from search_engine import SearchPreferences, search
+
+        # The most searched orderings of the last runs are ranked before the first search
+        dataset = load_dataset()
+        orderings = ordering_stats.most_common()
+        if orderings:
+            dataset.materialize_rankings(orderings)
+        search(SearchPreferences(), dataset)
+        print(f'Warmed up dataset {dataset.version} ({len(dataset)} properties, {len(dataset.rankings or {})} rankings) in {time.perf_counter() - start_time:.2f}s')
+
+    from streamlit.web import cli as streamlit_cli
+
+    sys.argv = ['streamlit', 'run', 'main.py'] + streamlit_args
+    sys.exit(streamlit_cli.main())
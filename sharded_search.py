@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import pandas as pd
+from columnar import MANIFEST_FILE, write_columns
+from dataset import DATA_PATH, add_derived_columns, load_dataset, read_properties_csv
+from postcodes import extract_outward_codes, normalize_postcode
+from ranking import preference_weights, rank_alignment, weighted_scores
+from search_engine import TOP_RATED_ALIGNMENT
+
+
+# The directory of the shards, one columnar dataset per postcode area
+SHARDS_PATH = os.path.join('data', 'shards')
+
+# The shard of the properties without a postcode
+NO_AREA_SHARD = '_'
+
+
+def postcode_areas(addresses):
+    # The postcode area of each address (e.g. NW for NW1 6XE)
+    return extract_outward_codes(addresses).str.extract(r'^([A-Z]+)', expand=False).fillna(NO_AREA_SHARD)
+
+
+def build_shards(df, shards_path=SHARDS_PATH):
+    """Write the properties of df as one columnar dataset per postcode area."""
+    for area, shard_df in df.groupby(postcode_areas(df['address']), sort=True):
+        write_columns(shard_df.reset_index(drop=True), os.path.join(shards_path, area))
+
+
+def shard_size(shard_path):
+    # The number of properties of a shard, from its manifest
+    with open(os.path.join(shard_path, MANIFEST_FILE)) as manifest_file:
+        return json.load(manifest_file)['rows']
+
+
+# The alignment of the last search of each shard of this worker process, for the count of its top-rated properties
+_last_alignments = {}
+
+
+def shard_alignment(dataset, preferences):
+    # The positions of the properties of a shard matching the filters, and their raw alignment
+    filtered_positions = dataset.index.filter_positions(
+        preferences.min_monthly_rent,
+        preferences.max_monthly_rent,
+        preferences.postcode,
+        preferences.number_of_bedrooms,
+        exclude_enough_photos_overall=preferences.exclude_enough_photos_overall,
+        exclude_enough_bedroom_photos=preferences.exclude_enough_bedroom_photos,
+        exclude_room_to_rent=preferences.exclude_room_to_rent,
+        excluded_platforms=preferences.excluded_platforms(),
+    )
+    if not preferences.order_feature_options or len(filtered_positions) == 0:
+        return filtered_positions, None
+    return filtered_positions, weighted_scores(dataset.feature_scores[filtered_positions], preference_weights(preferences.order_feature_options))
+
+
+def search_shard(shard_path, preferences, k):
+    # The best k properties of a shard, with the largest raw alignment so that the shards can be normalized together.
+    # Runs in the worker process of the shard, where it is loaded once and then kept in memory
+    dataset = load_dataset(shard_path, deltas_path=None)
+    filtered_positions, alignment = shard_alignment(dataset, preferences)
+
+    if alignment is None:
+        rows = dataset.rows(filtered_positions[:k])
+        max_alignment = None
+    else:
+        _last_alignments[shard_path] = (preferences, alignment)
+        order = rank_alignment(alignment, k)
+        rows = dataset.rows(filtered_positions[order]).assign(preferences_alignment=alignment[order])
+        max_alignment = alignment.max()
+
+    # The rows are sent back as plain values, rather than with all the categories of the shard
+    rows = rows.astype({column: object for column in rows.select_dtypes('category').columns})
+    return len(filtered_positions), max_alignment, rows
+
+
+def count_top_rated(shard_path, preferences, scale):
+    # The number of properties of a shard that are top-rated once their alignment is normalized by scale,
+    # from the alignment of the search that just ran in this worker process
+    last_preferences, alignment = _last_alignments.get(shard_path, (None, None))
+    if last_preferences != preferences:
+        alignment = shard_alignment(load_dataset(shard_path, deltas_path=None), preferences)[1]
+    return int((alignment / scale >= TOP_RATED_ALIGNMENT).sum())
+
+
+class ShardedSearch:
+    """A search over a dataset partitioned by postcode area, run in a pool of processes.
+
+    Each query only goes to the shards its postcode can match. The shards return
+    their best k properties and their largest alignment, and the properties are
+    merged by preferences alignment and rent.
+    Every shard is pinned to one worker process, so that each worker only loads
+    its own shards, and the shards are spread so that the workers hold about as
+    many properties each.
+    """
+
+    def __init__(self, shards_path=SHARDS_PATH, max_workers=None):
+        self.shards_path = shards_path
+        # The versions of a shard next to its link have a dot in their name, the areas do not
+        self.areas = sorted(
+            name for name in os.listdir(shards_path)
+            if '.' not in name and os.path.exists(os.path.join(shards_path, name, MANIFEST_FILE))
+        )
+
+        # One process per executor, so that the shards sent to an executor always go to the same process
+        number_of_workers = max(1, min(max_workers or os.cpu_count() or 1, len(self.areas)))
+        self.executors = [
+            ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn'))
+            for _ in range(number_of_workers)
+        ]
+
+        # The largest shards first, each to the worker with the fewest properties so far
+        worker_sizes = [0] * number_of_workers
+        self.executor_by_area = {}
+        sizes = {area: shard_size(os.path.join(shards_path, area)) for area in self.areas}
+        for area in sorted(self.areas, key=lambda area: -sizes[area]):
+            worker = worker_sizes.index(min(worker_sizes))
+            worker_sizes[worker] += sizes[area]
+            self.executor_by_area[area] = self.executors[worker]
+
+    def shards_for(self, postcode):
+        # The shards whose postcode area can match the postcode
+        postcode = normalize_postcode(postcode)
+        if not postcode:
+            return self.areas
+
+        letters = re.match(r'[A-Z]*', postcode).group()
+        if len(letters) < len(postcode):
+            # The postcode has its whole area, e.g. NW1
+            return [area for area in self.areas if area == letters]
+        return [area for area in self.areas if area.startswith(letters)]
+
+    def search(self, preferences, k=50):
+        """Return the number of properties matching the filters, the number of results and the best k of them."""
+        preferences = preferences.normalized()
+
+        # Fan the query out to the shards, with the top-rated filter left until the alignment is normalized
+        shard_preferences = preferences._replace(show_only_top_rated_properties=False)
+        areas = self.shards_for(preferences.postcode)
+        futures = [
+            self.executor_by_area[area].submit(search_shard, os.path.join(self.shards_path, area), shard_preferences, k)
+            for area in areas
+        ]
+        shard_results = [future.result() for future in futures]
+
+        number_of_results = sum(shard_count for shard_count, _, _ in shard_results)
+        rows = [shard_rows for _, _, shard_rows in shard_results if len(shard_rows)]
+        if not rows:
+            return number_of_results, 0, pd.DataFrame()
+        rows = pd.concat(rows, ignore_index=True)
+
+        if not preferences.order_feature_options:
+            rows = rows.sort_values(by='monthly_int', kind='stable', ignore_index=True).head(k)
+            return number_of_results, number_of_results, rows
+
+        # Normalise the values to 1 over all the shards
+        max_value = max(max_alignment for _, max_alignment, _ in shard_results if max_alignment is not None)
+        scale = max_value if max_value > 1 else 1
+        rows['preferences_alignment'] = rows['preferences_alignment'] / scale
+
+        # Merge the best properties of the shards by preferences alignment, then by rent
+        rows = rows.sort_values(by=['preferences_alignment', 'monthly_int'], ascending=[False, True], kind='stable', ignore_index=True)
+
+        total = number_of_results
+        if preferences.show_only_top_rated_properties:
+            # The shards count their top-rated properties once the scale over all of them is known
+            futures = [
+                self.executor_by_area[area].submit(count_top_rated, os.path.join(self.shards_path, area), shard_preferences, scale)
+                for area, (_, max_alignment, _) in zip(areas, shard_results) if max_alignment is not None
+            ]
+            total = sum(future.result() for future in futures)
+            rows = rows[rows['preferences_alignment'] >= TOP_RATED_ALIGNMENT]
+
+        return number_of_results, total, rows.head(k)
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+
+# Partition the properties csv into shards by postcode area
+#
+#   python sharded_search.py [--csv data/properties.csv] [--output data/shards]
+#
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partition the properties into shards by postcode area.')
+    parser.add_argument('--csv', default=DATA_PATH, help='The properties csv file')
+    parser.add_argument('--output', default=SHARDS_PATH, help='The directory of the shards')
+    args = parser.parse_args()
+
+    build_shards(add_derived_columns(read_properties_csv(args.csv)), args.output)
+    print(f'Wrote the shards of {args.csv} to {args.output}')
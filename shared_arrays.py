@@ -0,0 +1,66 @@
+import hashlib
+import os
+import shutil
+import time
+import numpy as np
+
+
+# The seconds after which the arrays of a version nothing writes to anymore are removed, so that the
+# processes still loading an older version find its files rather than racing their removal
+STALE_VERSION_SECONDS = 3600
+
+
+def shared_arrays_path():
+    # The directory of the arrays shared by the processes of this host, best on a memory file
+    # system such as /dev/shm. When SHARED_ARRAYS_PATH is not set every process computes its own
+    return os.environ.get('SHARED_ARRAYS_PATH')
+
+
+def shared_array(namespace, version, name, compute):
+    """Return the array made by compute, shared with the other processes of the host.
+
+    The first process to need the array for a version of a namespace writes it,
+    and every process maps the same file read-only. The versions that nothing
+    wrote to for STALE_VERSION_SECONDS are removed; the processes still using
+    them keep their mappings until they let go of them. When the file goes away
+    while it is being written or mapped, the process keeps its own array.
+    """
+    path = shared_arrays_path()
+    if not path:
+        return compute()
+
+    namespace_path = os.path.join(path, hashlib.sha1(namespace.encode()).hexdigest()[:16])
+    version_path = os.path.join(namespace_path, version)
+    file_path = os.path.join(version_path, f'{name}.npy')
+
+    try:
+        return np.load(file_path, mmap_mode='r', allow_pickle=False)
+    except FileNotFoundError:
+        pass
+
+    array = np.ascontiguousarray(compute())
+    try:
+        os.makedirs(version_path, mode=0o700, exist_ok=True)
+
+        # Written aside and renamed, so that no process maps a file being written
+        build_path = f'{file_path}.build-{os.getpid()}'
+        with open(build_path, 'wb') as array_file:
+            np.save(array_file, array, allow_pickle=False)
+        os.replace(build_path, file_path)
+
+        remove_stale_versions(namespace_path, version)
+        return np.load(file_path, mmap_mode='r', allow_pickle=False)
+    except FileNotFoundError:
+        return array
+
+
+def remove_stale_versions(namespace_path, version):
+    # The other versions of the namespace that nothing wrote to for a while
+    for old_version in os.listdir(namespace_path):
+        old_version_path = os.path.join(namespace_path, old_version)
+        try:
+            stale = time.time() - os.stat(old_version_path).st_mtime > STALE_VERSION_SECONDS
+        except FileNotFoundError:
+            continue
+        if old_version != version and stale:
+            shutil.rmtree(old_version_path, ignore_errors=True)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+from ranking import rank_alignment
+
+
+# The nearest properties by the fast distance are measured again exactly, this many times the number asked for
+RERANK_FACTOR = 4
+
+
+class SimilarityIndex:
+    """A flat index of the properties in feature score space.
+
+    The distance of every property to a query is one product of the score
+    matrix with the scores of the query, using the squared norms of the rows
+    computed once. Only the nearest properties by that distance are measured
+    again exactly. The rows are in rent order, so a rent band is a slice of them.
+    """
+
+    def __init__(self, property_ids, feature_scores, monthly_rent):
+        self.feature_scores = feature_scores
+        self.monthly_rent = monthly_rent
+        self.squared_norms = np.einsum('ij,ij->i', feature_scores, feature_scores)
+        self._property_ids = property_ids
+        self._positions = None
+
+    def position(self, property_id):
+        # The position of a property, with the hash table of the ids built on the first lookup
+        if self._positions is None:
+            self._positions = pd.Index(self._property_ids.astype(str).to_numpy())
+        position = self._positions.get_indexer([str(property_id)])[0]
+        if position < 0:
+            raise KeyError(property_id)
+        return position
+
+    def nearest(self, position, k=10, rent_band=None):
+        """Return the positions of the k properties nearest to the one at position, and their distances.
+
+        With a rent band, only the properties whose rent is at most that far from
+        the rent of the property are searched. The property itself is never returned,
+        and properties at the same distance are in rent order.
+        """
+        start, stop = 0, len(self.feature_scores)
+        if rent_band is not None:
+            # As a Python int, so that the band around an int16 rent does not overflow
+            rent = int(self.monthly_rent[position])
+            start = np.searchsorted(self.monthly_rent, rent - rent_band, side='left')
+            stop = np.searchsorted(self.monthly_rent, rent + rent_band, side='right')
+
+        query = self.feature_scores[position]
+        distances = self.squared_norms[start:stop] - 2 * (self.feature_scores[start:stop] @ query)
+
+        # The property is not similar to itself, it is the property
+        if start <= position < stop:
+            distances[position - start] = np.inf
+
+        # The nearest candidates by the fast distance, then the exact distances of those
+        candidates = rank_alignment(-distances, min(k * RERANK_FACTOR, stop - start))
+        candidates = candidates[np.isfinite(distances[candidates])]
+        exact_distances = np.sqrt(((self.feature_scores[start + candidates] - query) ** 2).sum(axis=1))
+        order = np.lexsort((candidates, exact_distances))[:k]
+
+        return start + candidates[order], exact_distances[order]
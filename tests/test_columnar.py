@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import columnar
+from columnar import read_columns, write_columns
+
+
+def properties_frame():
+    return pd.DataFrame({
+        'property_id': ['1', '2', '3', '4'],
+        'address': ['1 High Street', None, '3 Mill Road', '4 Green Lane'],
+        'platform': ['Zoopla', 'Rightmove', 'Zoopla', 'Zoopla'],
+        'monthly_int': [800, 900, 1000, 1100],
+        'natural_light_score': [0.5, np.nan, 1.0, 0.25],
+    })
+
+
+def values(series):
+    # The values of a column as plain Python values, with None for the missing ones
+    return [None if pd.isna(value) else value for value in series.tolist()]
+
+
+@pytest.mark.parametrize('with_pyarrow', [True, False])
+def test_columns_round_trip(tmp_path, monkeypatch, with_pyarrow):
+    if not with_pyarrow:
+        monkeypatch.setattr(columnar, 'pa', None)
+    df = properties_frame()
+    write_columns(df, str(tmp_path / 'properties'))
+
+    read_df = read_columns(str(tmp_path / 'properties'))
+    for column in df.columns:
+        assert values(read_df[column]) == values(df[column])
+
+    # The unique text is mapped from its own files, the repetitive text is kept as categories
+    assert read_df['platform'].dtype == 'category'
+    assert read_df['property_id'].dtype != 'category'
+
+
+def test_write_swaps_the_dataset_in_place(tmp_path):
+    path = str(tmp_path / 'properties')
+    write_columns(properties_frame(), path)
+    old_df = read_columns(path)
+
+    new_df = properties_frame().assign(monthly_int=[100, 200, 300, 400])
+    write_columns(new_df, path)
+    write_columns(new_df, path)
+
+    assert read_columns(path)['monthly_int'].tolist() == [100, 200, 300, 400]
+    assert os.path.islink(path)
+    # The dataset read before the swaps is still readable
+    assert old_df['monthly_int'].tolist() == [800, 900, 1000, 1100]
+    # Only the current dataset and the previous one are kept
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_write_only_removes_the_datasets_it_wrote(tmp_path):
+    path = str(tmp_path / 'properties')
+    (tmp_path / 'properties.my-notes').mkdir()
+    (tmp_path / 'properties.csv').write_text('property_id\n1\n')
+
+    # A dataset written before the datasets were linked is kept as the previous one
+    os.makedirs(path)
+    (tmp_path / 'properties' / 'manifest.json').write_text('{}')
+    write_columns(properties_frame(), path)
+    assert any(name.endswith('.old') for name in os.listdir(tmp_path))
+
+    write_columns(properties_frame(), path)
+    write_columns(properties_frame(), path)
+    names = sorted(os.listdir(tmp_path))
+    assert 'properties.my-notes' in names and 'properties.csv' in names
+    assert not any(name.endswith('.old') for name in names)
+    assert len(names) == 5
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import generate_properties
+from dataset import Dataset, add_derived_columns, feature_score_matrix, read_deltas, read_deltas_digest
+from search_index import SearchIndex
+
+
+def prepared_dataset(df):
+    df = add_derived_columns(df.sort_values(by='monthly_int', kind='stable', ignore_index=True))
+    return Dataset('properties.csv', (0, 0), df)
+
+
+def assert_same_groups(groups, expected_groups):
+    assert groups.keys() == expected_groups.keys()
+    for key, positions in expected_groups.items():
+        assert groups[key].tolist() == positions.tolist()
+
+
+def test_patched_index_matches_a_rebuilt_one():
+    properties = generate_properties(2000)
+    dataset = prepared_dataset(properties)
+
+    for step in range(3):
+        upserted = properties.sample(100, random_state=step).copy()
+        upserted['property_id'] = [f'{step}-{i}' if i % 2 else property_id for i, property_id in enumerate(upserted['property_id'])]
+        upserted['monthly_int'] = np.random.default_rng(step).integers(500, 3000, len(upserted))
+        upserted.loc[upserted.index[:3], 'platform'] = 'OpenRent'
+        removed_ids = list(properties['property_id'].sample(50, random_state=10 + step))
+        dataset = dataset.apply_deltas([f'{step}.csv'], upserted, removed_ids)
+
+    rows = dataset.rows(np.arange(len(dataset)))
+    index = SearchIndex(rows)
+    assert dataset.index.monthly_rent.tolist() == index.monthly_rent.tolist()
+    assert dataset.index.room_to_rent.tolist() == index.room_to_rent.tolist()
+    assert_same_groups(dataset.index.bedroom_groups, index.bedroom_groups)
+    assert_same_groups(dataset.index.platform_groups, index.platform_groups)
+    assert_same_groups(dataset.index.postcodes.prefixes, index.postcodes.prefixes)
+    assert np.array_equal(dataset.feature_scores, feature_score_matrix(rows))
+    assert dataset.column('property_id').is_unique
+
+
+def test_read_deltas_keeps_the_last_change_of_each_property(tmp_path):
+    pd.DataFrame({'property_id': ['1', '2'], 'monthly_int': [800, 900]}).to_csv(tmp_path / '001.csv', index=False)
+    pd.DataFrame({'property_id': ['1', '3'], 'removed': [True, True]}).to_csv(tmp_path / '002.csv', index=False)
+    pd.DataFrame({'property_id': ['3'], 'monthly_int': [1000]}).to_csv(tmp_path / '003.csv', index=False)
+
+    upserted, removed_ids = read_deltas(str(tmp_path), ['001.csv', '002.csv', '003.csv'])
+    assert upserted.to_dict('list') == {'property_id': ['2', '3'], 'monthly_int': [900, 1000]}
+    assert removed_ids == ['1']
+
+
+def test_version_follows_the_deltas_applied_not_their_number(tmp_path):
+    dataset = prepared_dataset(generate_properties(200))
+    pd.DataFrame({'property_id': ['1'], 'monthly_int': [800]}).to_csv(tmp_path / '001.csv', index=False)
+    pd.DataFrame({'property_id': ['2'], 'removed': [True]}).to_csv(tmp_path / '002.csv', index=False)
+
+    def version(names):
+        digest = read_deltas_digest(dataset.deltas_digest, str(tmp_path), names)
+        return dataset.apply_deltas(names, None, [], deltas_digest=digest).version
+
+    first = version(['001.csv', '002.csv'])
+    assert first != dataset.version
+    assert first == version(['001.csv', '002.csv'])
+    assert first != version(['002.csv', '001.csv'])
+
+    pd.DataFrame({'property_id': ['1'], 'monthly_int': [900]}).to_csv(tmp_path / '001.csv', index=False)
+    assert first != version(['001.csv', '002.csv'])
+    assert dataset.apply_deltas(['001.csv'], None).version != dataset.apply_deltas(['002.csv'], None).version
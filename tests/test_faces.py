@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from dataset import FACE_BIN_EDGES, apply_face, apply_faces
+
+
+def edge_values(dtype):
+    # The edges of the score dots and the values next to them, in the precision of dtype
+    values = [0.0, 1.0, 1.5, 2.0, -0.1, -1.0, np.nan, np.inf, -np.inf]
+    for edge in FACE_BIN_EDGES + [1]:
+        edge = dtype(edge)
+        values.extend([edge, np.nextafter(edge, dtype(-np.inf)), np.nextafter(edge, dtype(np.inf))])
+    return np.array(values, dtype=dtype)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_apply_faces_matches_apply_face(dtype):
+    values = edge_values(dtype)
+    assert list(apply_faces(values)) == [apply_face(value) for value in values]
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_apply_faces_matches_apply_face_on_random_scores(dtype):
+    values = np.random.default_rng(0).uniform(-0.2, 1.2, size=10_000).astype(dtype)
+    assert list(apply_faces(values)) == [apply_face(value) for value in values]
+
+
+def test_apply_faces_keeps_the_shape():
+    values = np.array([[0.1, 0.5], [0.9, np.nan]])
+    assert apply_faces(values).tolist() == [['●○○○○', '●●●○○'], ['●●●●●', 'None']]
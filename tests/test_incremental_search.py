@@ -0,0 +1,102 @@
+from collections import Counter
+import pytest
+import search_engine
+from benchmarks.synthetic import generate_properties
+from dataset import Dataset, add_derived_columns
+from search_engine import IncrementalSearch, SearchPreferences, find_properties
+
+
+PREFERENCES = SearchPreferences(
+    order_feature_options=('Natural Light', 'High Ceiling'),
+    number_of_bedrooms=2,
+    min_monthly_rent=0,
+    max_monthly_rent=100000,
+    exclude_enough_photos_overall=False,
+    exclude_enough_bedroom_photos=False,
+    exclude_room_to_rent=False,
+)
+
+
+def prepared_dataset(df, signature=(0, 0)):
+    df = add_derived_columns(df.sort_values(by='monthly_int', kind='stable', ignore_index=True))
+    return Dataset('properties.csv', signature, df)
+
+
+@pytest.fixture
+def stage_calls(monkeypatch):
+    # The number of times each stage of the searches is computed
+    calls = Counter()
+    for name, function in [
+        ('filter', search_engine.filter_properties),
+        ('platforms', search_engine.exclude_platforms),
+        ('score', search_engine.score_properties),
+        ('sort', search_engine.sort_properties),
+    ]:
+        def counted(*args, name=name, function=function, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        monkeypatch.setattr(search_engine, function.__name__, counted)
+    return calls
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    return prepared_dataset(generate_properties(2000))
+
+
+def assert_same_results(found_properties, expected_properties):
+    assert found_properties[0] == expected_properties[0]
+    assert found_properties[1].tolist() == expected_properties[1].tolist()
+    assert found_properties[2].tolist() == expected_properties[2].tolist()
+
+
+def test_reordering_the_features_only_ranks_again(dataset, stage_calls):
+    incremental = IncrementalSearch()
+    find_properties(dataset, PREFERENCES, incremental)
+    assert stage_calls == {'filter': 1, 'platforms': 1, 'score': 1, 'sort': 1}
+
+    reordered = PREFERENCES._replace(order_feature_options=('High Ceiling', 'Natural Light'))
+    found_properties = find_properties(dataset, reordered, incremental)
+    assert stage_calls == {'filter': 1, 'platforms': 1, 'score': 2, 'sort': 2}
+    assert_same_results(found_properties, find_properties(dataset, reordered))
+
+
+def test_excluding_a_platform_only_runs_the_later_stages(dataset, stage_calls):
+    incremental = IncrementalSearch()
+    find_properties(dataset, PREFERENCES, incremental)
+
+    without_zoopla = PREFERENCES._replace(exclude_zoopla=True)
+    found_properties = find_properties(dataset, without_zoopla, incremental)
+    assert stage_calls == {'filter': 1, 'platforms': 2, 'score': 2, 'sort': 2}
+    assert_same_results(found_properties, find_properties(dataset, without_zoopla))
+
+    # The same search again computes nothing
+    find_properties(dataset, without_zoopla, incremental)
+    assert stage_calls == {'filter': 2, 'platforms': 3, 'score': 3, 'sort': 3}
+
+
+def test_new_dataset_version_computes_every_stage_again(dataset, stage_calls):
+    incremental = IncrementalSearch()
+    find_properties(dataset, PREFERENCES, incremental)
+
+    next_dataset = prepared_dataset(generate_properties(2000), signature=(1, 0))
+    found_properties = find_properties(next_dataset, PREFERENCES, incremental)
+    assert stage_calls == {'filter': 2, 'platforms': 2, 'score': 2, 'sort': 2}
+    assert_same_results(found_properties, find_properties(next_dataset, PREFERENCES))
+
+
+def test_stage_outputs_are_kept_within_max_bytes(dataset, stage_calls):
+    unbounded = IncrementalSearch()
+    find_properties(dataset, PREFERENCES, unbounded)
+    sizes = {name: size for name, (_, _, size) in unbounded.stages.items()}
+
+    # The sorted results do not fit with the outputs of the stages before them
+    incremental = IncrementalSearch(max_bytes=sum(sizes.values()) - 1)
+    find_properties(dataset, PREFERENCES, incremental)
+    assert list(incremental.stages) == ['filter', 'platforms', 'score']
+    assert incremental.nbytes == sizes['filter'] + sizes['platforms'] + sizes['score'] <= incremental.max_bytes
+
+    # An output that was not kept is computed again, with the same results
+    found_properties = find_properties(dataset, PREFERENCES, incremental)
+    assert stage_calls == {'filter': 2, 'platforms': 2, 'score': 2, 'sort': 3}
+    assert_same_results(found_properties, find_properties(dataset, PREFERENCES, unbounded))
@@ -0,0 +1,46 @@
+import os
+import time
+import pytest
+import dataset
+from benchmarks.synthetic import generate_properties
+from columnar import write_columns
+from dataset import add_derived_columns, load_dataset, read_properties_csv
+
+
+def wait_for_next(loaded):
+    # The dataset that replaces loaded once it is prepared in the background
+    for _ in range(500):
+        next_dataset = load_dataset(deltas_path=None)
+        if next_dataset is not loaded:
+            return next_dataset
+        time.sleep(0.01)
+    raise TimeoutError
+
+
+@pytest.fixture
+def data_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, 'DATA_PATH', str(tmp_path / 'properties.csv'))
+    monkeypatch.setattr(dataset, 'COLUMNAR_DATA_PATH', str(tmp_path / 'properties'))
+    monkeypatch.setattr(dataset, '_datasets', {})
+    generate_properties(200).to_csv(dataset.DATA_PATH, index=False)
+    write_columns(add_derived_columns(read_properties_csv(dataset.DATA_PATH)).reset_index(drop=True), dataset.COLUMNAR_DATA_PATH)
+    return tmp_path
+
+
+def test_a_new_data_file_replaces_the_loaded_dataset(data_files):
+    columnar_dataset = load_dataset(deltas_path=None)
+    assert columnar_dataset.path == dataset.COLUMNAR_DATA_PATH
+
+    # A newer csv file is loaded in the background, the columnar dataset is used meanwhile
+    os.utime(dataset.DATA_PATH, ns=(time.time_ns() + 10**9,) * 2)
+    assert load_dataset(deltas_path=None) is columnar_dataset
+    csv_dataset = wait_for_next(columnar_dataset)
+    assert csv_dataset.path == dataset.DATA_PATH
+
+    # The columnar dataset built again from it replaces it in turn, and the older one is not used again
+    write_columns(add_derived_columns(read_properties_csv(dataset.DATA_PATH)).reset_index(drop=True), dataset.COLUMNAR_DATA_PATH)
+    os.utime(os.path.join(dataset.COLUMNAR_DATA_PATH, 'manifest.json'), ns=(time.time_ns() + 2 * 10**9,) * 2)
+    rebuilt_dataset = wait_for_next(csv_dataset)
+    assert rebuilt_dataset.path == dataset.COLUMNAR_DATA_PATH
+    assert rebuilt_dataset is not columnar_dataset
+    assert list(dataset._datasets.values()) == [rebuilt_dataset]
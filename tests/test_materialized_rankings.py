@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from benchmarks.synthetic import generate_properties
+from dataset import add_derived_columns, feature_score_matrix
+from materialized_rankings import MaterializedRanking
+from ranking import FEATURE_POSITIONS, preference_weights, preferences_alignment, rank_alignment
+
+
+def assert_same_as_scored(ranking, feature_scores, positions):
+    # The properties picked out of a materialized ranking are in the order of the ones scored and sorted
+    alignment = preferences_alignment(feature_scores, positions, preference_weights(ranking.ordering))
+    order = rank_alignment(alignment)
+    ranked_positions, ranked_alignment = ranking.rank(positions)
+    assert ranked_positions.tolist() == positions[order].tolist()
+    assert ranked_alignment.tolist() == alignment[order].tolist()
+
+
+@pytest.mark.parametrize('ordering', [
+    ('Natural Light',),
+    ('Natural Light', 'Large Windows', 'High Ceiling'),
+    ('No Carpets', 'No Wide Lenses', 'No Edited Photos', 'Natural Light', 'Large Windows', 'High Ceiling'),
+])
+def test_materialized_ranking_matches_the_scored_one(ordering):
+    df = add_derived_columns(generate_properties(3000).sort_values(by='monthly_int', kind='stable', ignore_index=True))
+    feature_scores = feature_score_matrix(df)
+    ranking = MaterializedRanking(feature_scores, ordering)
+
+    rng = np.random.default_rng(len(ordering))
+    for size in (3000, 1000, 10, 1):
+        positions = np.sort(rng.choice(len(df), size, replace=False))
+        assert_same_as_scored(ranking, feature_scores, positions)
+    assert_same_as_scored(ranking, feature_scores, np.arange(0))
+
+
+def test_materialized_ranking_keeps_rent_order_of_the_ties_made_by_normalising():
+    # Two scores next to each other that are equal once divided by the best score, which
+    # happens when the best score is in a higher power of two than them
+    best = np.float32(5)
+    score = np.float32(3.5)
+    while score / best != np.nextafter(score, best) / best:
+        score = np.nextafter(score, best)
+    higher_score = np.nextafter(score, best)
+
+    # The higher score is on the more expensive property, so the ranking over all the properties
+    # puts it first while the properties scored on the fly are in rent order
+    feature_scores = np.zeros((4, len(FEATURE_POSITIONS)), dtype=np.float32)
+    feature_scores[:, FEATURE_POSITIONS['Natural Light']] = [best, score, 1, higher_score]
+    ranking = MaterializedRanking(feature_scores, ('Natural Light',))
+    assert ranking.order.tolist() == [0, 3, 1, 2]
+
+    assert_same_as_scored(ranking, feature_scores, np.arange(4))
+    assert ranking.rank(np.arange(4))[0].tolist() == [0, 1, 3, 2]
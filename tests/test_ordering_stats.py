@@ -0,0 +1,16 @@
+from materialized_rankings import OrderingStats
+
+
+def test_processes_add_up_their_counts(tmp_path):
+    path = str(tmp_path / 'ordering_counts.json')
+    first, second = OrderingStats(path), OrderingStats(path)
+
+    first.observe(('Natural Light',))
+    second.observe(('Natural Light',))
+    second.observe(('Fireplace',))
+    first.save()
+    second.save()
+    first.save()
+
+    assert OrderingStats(path).counts == {('Natural Light',): 2, ('Fireplace',): 1}
+    assert first.counts == {('Natural Light',): 2, ('Fireplace',): 1}
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+from postcodes import PostcodePrefixIndex, extract_postcodes, normalize_postcode
+
+
+ADDRESSES = pd.Series([
+    "1 High Street, London E1 6AN",
+    "2 Station Road, London E16 1AB",
+    "3 Church Lane, London E1 4XY",
+    "4 Park Avenue, London E14 9TT",
+    "5 Mill Road, London",
+])
+
+
+@pytest.fixture
+def index():
+    return PostcodePrefixIndex(*extract_postcodes(ADDRESSES))
+
+
+@pytest.mark.parametrize('postcode, expected', [
+    ('e1', 'E1'),
+    (' E16 ', 'E16 '),
+    ('E1 6', 'E1 6'),
+    ('E1  6 ', 'E1 6'),
+    ('E1 ', 'E1 '),
+    ('   ', ''),
+])
+def test_normalize_postcode(postcode, expected):
+    assert normalize_postcode(postcode) == expected
+
+
+@pytest.mark.parametrize('postcode, positions', [
+    ('E', [0, 1, 2, 3]),
+    ('E1', [0, 1, 2, 3]),
+    ('E16', [1]),
+    ('E1 ', [0, 2]),
+    ('E1 6', [0]),
+    ('E1 6AN', [0]),
+    ('E1 5', []),
+    ('N', []),
+])
+def test_lookup(index, postcode, positions):
+    assert index.lookup(postcode).tolist() == positions
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+import numpy as np
+import result_cache
+from result_cache import ResultCache, SharedResultCache
+
+
+def test_cache_evicts_the_least_recently_used_entries():
+    cache = ResultCache(max_entries=2)
+    cache.put('a', 'v1', 'A', 1)
+    cache.put('b', 'v1', 'B', 1)
+    assert cache.get('a', 'v1') == 'A'
+
+    cache.put('c', 'v1', 'C', 1)
+    assert cache.get('b', 'v1') is None
+    assert (cache.get('a', 'v1'), cache.get('c', 'v1')) == ('A', 'C')
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'invalidations': 0, 'entries': 2, 'bytes': 2}
+
+
+def test_cache_is_bounded_by_the_bytes_of_its_entries():
+    cache = ResultCache(max_bytes=100)
+    cache.put('a', 'v1', 'A', 40)
+    cache.put('b', 'v1', 'B', 40)
+    cache.put('c', 'v1', 'C', 40)
+    assert cache.get('a', 'v1') is None
+    assert cache.stats()['bytes'] == 80
+
+    # A result larger than the whole cache is not cached, and evicts nothing
+    cache.put('d', 'v1', 'D', 101)
+    assert cache.get('d', 'v1') is None
+    assert cache.stats()['evictions'] == 1
+
+    # Replacing an entry counts only its new size
+    cache.put('b', 'v1', 'B2', 10)
+    assert cache.stats()['bytes'] == 50
+
+
+def test_cache_entries_expire(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(result_cache, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    cache = ResultCache(ttl=60)
+    cache.put('a', 'v1', 'A', 1)
+
+    now[0] = 60
+    assert cache.get('a', 'v1') == 'A'
+    now[0] = 61
+    assert cache.get('a', 'v1') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_new_dataset_version_invalidates_the_cache():
+    cache = ResultCache()
+    cache.put('a', 'v1', 'A', 1)
+    cache.put('b', 'v1', 'B', 1)
+
+    assert cache.get('a', 'v2') is None
+    cache.put('a', 'v2', 'A2', 1)
+    assert cache.get('b', 'v1') is None
+    stats = cache.stats()
+    assert (stats['invalidations'], stats['entries'], stats['bytes']) == (2, 0, 0)
+
+
+def test_shared_cache_round_trips_the_found_properties(tmp_path):
+    cache = SharedResultCache(str(tmp_path / 'results.sqlite'))
+    positions = np.array([5, 2, 9], dtype=np.int64)
+    alignment = np.array([1.0, 0.5, 0.25], dtype=np.float32)
+    cache.put(('ranked',), 'v1', (3, positions, alignment), positions.nbytes + alignment.nbytes)
+    cache.put(('by rent',), 'v1', (0, positions[:0], None), 0)
+
+    number_of_results, cached_positions, cached_alignment = cache.get(('ranked',), 'v1')
+    assert number_of_results == 3
+    assert cached_positions.dtype == np.int64 and cached_positions.tolist() == [5, 2, 9]
+    assert cached_alignment.dtype == np.float32 and cached_alignment.tolist() == [1.0, 0.5, 0.25]
+
+    number_of_results, cached_positions, cached_alignment = cache.get(('by rent',), 'v1')
+    assert (number_of_results, cached_positions.tolist(), cached_alignment) == (0, [], None)
+    assert cache.get(('ranked',), 'v2') is None